@@ -20,9 +20,12 @@
 
 
 import os
+import json
 import numpy as np
 from time import sleep
+from timeit import default_timer as timer
 import threading
+from collections import namedtuple
 
 
 # Make sure usbtmc service running.  On linux: "sudo modprobe usbtmc".
@@ -33,39 +36,509 @@ import threading
 # Rigol DS1052E
 # SUBSYSTEMS=="usb", ACTION=="add", ATTRS{idVendor}=="1ab1", ATTRS{idProduct}=="0588", GROUP="usbtmc", MODE="0660"
 
+# Each device has its own lock and pacing state so several scopes can be used from different
+# threads at once.  Device files opened with open_device_file are looked up by path (so two
+# files on the same scope share them); any other file descriptor uses the module-wide lock.
 lock = threading.Lock()
 
 
-def _send_command(device_file, command, read_bytes=0):
-    lock.acquire()
+class _DeviceState(object):
+    def __init__(self, device_lock):
+        self.lock = device_lock
+        self.gap = 0.0   # pacing needed after the last command
+        self.done = 0.0  # when the last command finished
+        self.chain_measurements = True  # False once the scope didn't answer a chained :MEAS query
+        self.chain_settings = True      # the same for the chained settings queries
+
+
+_default_state = _DeviceState(lock)
+_states = {}      # real device path -> _DeviceState
+_open_files = {}  # file descriptor -> _DeviceState
+_registry_lock = threading.Lock()
+
+
+def _device_state(device_file):
+    return _open_files.get(device_file, _default_state)
+
+
+# Pacing between commands.  The scope drops commands that arrive while it is still busy with
+# a previous one.
+#   FIXED     sleeps FIXED_DELAY before every command (the original, most conservative behaviour)
+#   ADAPTIVE  only waits out what is left of the gap the previous command needs, plus
+#             PACING_MARGIN.  A query is finished once its response has been read, so only set
+#             commands need a gap.
+#   OPC       follows every set command with *OPC? and waits for the answer instead of sleeping
+FIXED = 'fixed'
+ADAPTIVE = 'adaptive'
+OPC = 'opc'
+FIXED_DELAY = 0.020
+
+# Gap in seconds needed after a set command, by command prefix (longest prefix wins).
+# Commands not listed get FIXED_DELAY.
+PACING = {
+    ':STOP': 0.020,
+    ':RUN': 0.020,
+    ':SING': 0.020,
+    ':KEY:FORC': 0.020,
+    ':WAV:POIN:MODE': 0.020,
+}
+QUERY_PACING = 0.0
+# The gap is timed from when the previous write returned, not from when the scope got the
+# command, so ADAPTIVE adds this much for USB delivery jitter
+PACING_MARGIN = 0.010
+
+_pacing = {'mode': ADAPTIVE}
+
+
+# Select FIXED, ADAPTIVE or OPC pacing, optionally updating the PACING table
+def set_pacing(mode, table=None):
+    if mode not in (FIXED, ADAPTIVE, OPC):
+        raise ValueError('unknown pacing mode: ' + str(mode))
+    _pacing['mode'] = mode
+    if table:
+        PACING.update(table)
+
+
+def get_pacing():
+    return _pacing['mode']
+
+
+def _command_gap(command):
+    for prefix in sorted(PACING, key=len, reverse=True):
+        if command.startswith(prefix):
+            return PACING[prefix]
+    return FIXED_DELAY
+
+
+def _pace(state):
+    if _pacing['mode'] == FIXED:
+        sleep(FIXED_DELAY)
+        return
+    if state.gap <= 0:
+        return
+    remaining = state.gap + PACING_MARGIN - (timer() - state.done)
+    if remaining > 0:
+        sleep(remaining)
+
+
+# Timing of every command, off by default (see enable_timing).  Each command's wall time is
+# split into waiting for the device lock, pacing sleep, write and read.
+CommandTiming = namedtuple('CommandTiming', ['command', 'start', 'lock_wait', 'sleep', 'write', 'read',
+                                             'bytes_written', 'bytes_read'])
+TIMING_PARTS = ['total', 'lock_wait', 'sleep', 'write', 'read']
+HISTOGRAM_MIN = 1e-6  # upper edge of the first histogram bucket in seconds, each next one doubles
+HISTOGRAM_BUCKETS = 28
+SPANS = ['get_points']  # timed as a whole on top of the commands they send
+
+
+class Histogram(object):
+    """ Counts durations in buckets that double in width, from HISTOGRAM_MIN seconds up,
+        and keeps their exact count, total, min and max. """
+
+    def __init__(self):
+        self._counts = [0] * HISTOGRAM_BUCKETS
+        self._count = 0
+        self._total = 0.0
+        self._min = None
+        self._max = None
+
+    def add(self, seconds):
+        bucket = 0
+        edge = HISTOGRAM_MIN
+        while seconds > edge and bucket < HISTOGRAM_BUCKETS - 1:
+            bucket += 1
+            edge *= 2
+        self._counts[bucket] += 1
+        self._count += 1
+        self._total += seconds
+        self._min = seconds if self._min is None else min(self._min, seconds)
+        self._max = seconds if self._max is None else max(self._max, seconds)
+
+    # Upper edge of the bucket holding the p-th percentile, capped at the largest duration
+    def percentile(self, p):
+        if self._count == 0:
+            return 0.0
+        rank = p / 100.0 * self._count
+        seen = 0
+        edge = HISTOGRAM_MIN
+        for count in self._counts:
+            seen += count
+            if count and seen >= rank:
+                break
+            edge *= 2
+        return min(edge, self._max)
+
+    def buckets(self):
+        """ (upper edge in seconds, count) of the buckets that aren't empty """
+        return [(HISTOGRAM_MIN * 2 ** i, count) for i, count in enumerate(self._counts) if count]
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def total(self):
+        return self._total
+
+    @property
+    def mean(self):
+        return self._total / self._count if self._count else 0.0
+
+    @property
+    def min(self):
+        return self._min or 0.0
+
+    @property
+    def max(self):
+        return self._max or 0.0
+
+    def to_dict(self):
+        return {'count': self._count, 'total': self._total, 'mean': self.mean, 'min': self.min,
+                'max': self.max, 'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'buckets': self.buckets()}
+
+
+# Name commands are grouped under: the headers without their arguments, e.g. :WAV:DATA?
+def _command_name(command):
+    return ';'.join(part.split(' ')[0] for part in command.split(';'))
+
+
+class Timings(object):
+    """ Histograms of command timings by command name.  With an os_file it only collects
+        the commands sent to that device file. """
+
+    def __init__(self, os_file=None):
+        self._os_file = os_file
+        self._lock = threading.Lock()
+        self._histograms = {}  # command name -> {part: Histogram}
+        self._bytes = {}       # command name -> [bytes written, bytes read]
+
+    def add(self, device_file, timing):
+        if self._os_file is not None and device_file != self._os_file:
+            return
+        name = _command_name(timing.command)
+        total = timing.lock_wait + timing.sleep + timing.write + timing.read
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = dict((part, Histogram()) for part in TIMING_PARTS)
+                self._bytes[name] = [0, 0]
+            histograms = self._histograms[name]
+            histograms['total'].add(total)
+            histograms['lock_wait'].add(timing.lock_wait)
+            histograms['sleep'].add(timing.sleep)
+            histograms['write'].add(timing.write)
+            histograms['read'].add(timing.read)
+            self._bytes[name][0] += timing.bytes_written
+            self._bytes[name][1] += timing.bytes_read
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._bytes = {}
+
+    def commands(self):
+        """ Command names, the one that took the most time in total first """
+        return sorted(self._histograms, key=lambda name: -self._histograms[name]['total'].total)
+
+    def histogram(self, command, part='total'):
+        return self._histograms[command][part]
+
+    def bytes_transferred(self, command):
+        """ (bytes written, bytes read) for command """
+        return tuple(self._bytes[command])
+
+    @property
+    def total(self):
+        """ Seconds spent in commands """
+        return sum(histograms['total'].total for name, histograms in self._histograms.items()
+                   if name not in SPANS)
+
+    def to_dict(self):
+        with self._lock:
+            return dict((name, {'bytes_written': self._bytes[name][0], 'bytes_read': self._bytes[name][1],
+                                'timing': dict((part, histogram.to_dict()) for part, histogram in histograms.items())})
+                        for name, histograms in self._histograms.items())
+
+    def dump(self, f):
+        json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    def summary(self):
+        """ A table of where the time went, by command """
+        lines = ['%-40s %6s %10s %10s %10s %10s %10s %10s %12s' %
+                 ('command', 'count', 'total', 'p90', 'lock', 'sleep', 'write', 'read', 'bytes read')]
+        for name in self.commands():
+            histograms = self._histograms[name]
+            lines.append('%-40s %6d %10.6f %10.6f %10.6f %10.6f %10.6f %10.6f %12d' %
+                         (name[:40], histograms['total'].count, histograms['total'].total,
+                          histograms['total'].percentile(90), histograms['lock_wait'].total,
+                          histograms['sleep'].total, histograms['write'].total,
+                          histograms['read'].total, self._bytes[name][1]))
+        lines.append('%-40s %6s %10.6f' % ('all', '', self.total))
+        return '\n'.join(lines)
+
+
+timings = Timings()  # every command while timing is enabled
+_timing = {'enabled': False, 'callback': None}
+_recorders = []      # Timings collecting for one capture, see start_recording
+_spans = threading.local()
+
+
+# Start timing commands.  Every CommandTiming is added to timings and passed to callback.
+def enable_timing(callback=None):
+    _timing['callback'] = callback
+    _timing['enabled'] = True
+
+
+def disable_timing():
+    _timing['enabled'] = False
+    _timing['callback'] = None
+
+
+def timing_enabled():
+    return _timing['enabled']
+
+
+# Collect the timings of the commands sent to os_file, e.g. for one query_scope, until
+# stop_recording is called with the Timings returned
+def start_recording(os_file=None):
+    recorder = Timings(os_file)
+    with _registry_lock:
+        _recorders.append(recorder)
+    return recorder
+
+
+def stop_recording(recorder):
+    with _registry_lock:
+        if recorder in _recorders:
+            _recorders.remove(recorder)
+    return recorder
+
+
+def _record(device_file, timing):
+    span = getattr(_spans, 'timings', None)
+    if span is not None:
+        span.append(timing)
+    timings.add(device_file, timing)
+    for recorder in list(_recorders):
+        recorder.add(device_file, timing)
+    callback = _timing['callback']
+    if callback is not None:
+        callback(timing)
+
+
+def _send_command(device_file, command, read_bytes=0, buffer=None):
+    state = _device_state(device_file)
+    start = timer()
+    state.lock.acquire()
+    locked = paced = written = timer()
+    gap = FIXED_DELAY
+    received = 0
     try:
-        sleep(0.020)
+        _pace(state)
+        paced = timer()
         os.write(device_file, bytearray(command, 'ascii'))
+        written = timer()
+        if buffer is not None:
+            gap = QUERY_PACING
+            response = _read_block(device_file, buffer)
+            received = response.nbytes + BLOCK_HEADER
+            return response
         if read_bytes > 0:
             response = os.read(device_file, read_bytes)
+            received = len(response)
+            gap = QUERY_PACING
             return response
+        if _pacing['mode'] == OPC:
+            os.write(device_file, bytearray('*OPC?', 'ascii'))
+            received = len(os.read(device_file, 20))
+            gap = QUERY_PACING
+        else:
+            gap = _command_gap(command)
     except:
         raise
     finally:
-        lock.release()
-        
+        state.gap = gap
+        state.done = timer()
+        state.lock.release()
+        if _timing['enabled']:
+            written = max(written, paced)
+            _record(device_file, CommandTiming(command, start, locked - start, paced - locked,
+                                               written - paced, state.done - written,
+                                               len(command), received))
+
+
+# Waveform data is a definite length block: '#', the number of length digits, the length
+# and then the samples, e.g. #800016384 followed by 16384 bytes.
+MAX_POINTS = 1048576
+BLOCK_HEADER = 10
+READ_CHUNK = None  # bytes per read while completing a block, None for all that is missing
+
+
+def new_points_buffer():
+    return np.empty(MAX_POINTS + BLOCK_HEADER, dtype=np.uint8)
+
+
+def _readinto(device_file, view):
+    if hasattr(os, 'readv'):
+        return os.readv(device_file, [view])
+    data = os.read(device_file, len(view))  # Python 2
+    view[:len(data)] = data
+    return len(data)
+
+
+class _BlockReader(object):
+    """ Tracks reading one block into a buffer.  next_view() is the part of the buffer to read
+        into next (None once complete) and advance() records how many bytes arrived. """
+
+    def __init__(self, buffer):
+        self._data = np.frombuffer(buffer, dtype=np.uint8)
+        self._view = memoryview(self._data)
+        self._received = 0
+        self._expected = len(self._data)
+        self._header_len = None
+        self._is_block = True
+
+    def next_view(self):
+        if self._received >= self._expected or not self._is_block:
+            return None
+        size = self._expected - self._received
+        if READ_CHUNK:
+            size = min(size, READ_CHUNK)
+        return self._view[self._received:self._received + size]
+
+    def advance(self, count):
+        data = self._data
+        self._received += count
+        if self._header_len is None and self._received >= 2:
+            if data[0] != ord('#') or not chr(data[1]).isdigit():
+                self._is_block = False  # not a block, read as the scope used to be read
+                return
+            self._header_len = 2 + int(chr(data[1]))
+        if (self._header_len is not None and self._expected == len(data) and
+                self._received >= self._header_len):
+            self._expected = min(self._header_len + int(data[2:self._header_len].tobytes()), len(data))
+
+    def result(self):
+        return self._data[self._header_len or BLOCK_HEADER:self._received]
+
+
+# Read a block straight into buffer and return its samples as a view of buffer.  The length
+# in the header is used to keep reading when the data arrives in several pieces (a split
+# USBTMC transfer, or the pseudo-terminal used by scope_sim) instead of truncating it.
+def _read_block(device_file, buffer):
+    reader = _BlockReader(buffer)
+    view = reader.next_view()
+    while view is not None:
+        count = _readinto(device_file, view)
+        if count == 0:
+            break
+        reader.advance(count)
+        view = reader.next_view()
+    return reader.result()
+
 
 # Open the device file
 def open_device_file(device_path):
     os_file = os.open(device_path, os.O_RDWR)
+    real_path = os.path.realpath(device_path)
+    with _registry_lock:
+        if real_path not in _states:
+            _states[real_path] = _DeviceState(threading.Lock())
+        _open_files[os_file] = _states[real_path]
     return os_file
 
 
 # Close the device file
 def close_device_file(os_file):
+    with _registry_lock:
+        _open_files.pop(os_file, None)
     os.close(os_file)
 
 
+class Session(object):
+    """ Keeps a device file open across many captures and caches what doesn't change,
+        such as the instrument identity.  Closing it hands the scope back to local control. """
+
+    def __init__(self, device_path):
+        self._device_path = device_path
+        self._os_file = None
+        self._id = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self._os_file is None:
+            self._os_file = open_device_file(self._device_path)
+        return self
+
+    def close(self, local=True):
+        if self._os_file is None:
+            return
+        try:
+            if local:
+                set_local(self._os_file)
+        finally:
+            close_device_file(self._os_file)
+            self._os_file = None
+
+    # Forget cached settings, e.g. after the scope was power cycled
+    def invalidate(self):
+        self._id = None
+
+    @property
+    def device_path(self):
+        return self._device_path
+
+    @property
+    def os_file(self):
+        if self._os_file is None:
+            raise IOError('session for ' + self._device_path + ' is not open')
+        return self._os_file
+
+    @property
+    def is_open(self):
+        return self._os_file is not None
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = get_id(self.os_file)
+        return self._id
+
+
 # Stop all acquisition
 def set_stop(os_file):
     _send_command(os_file, ":STOP")
 
 
+# Start continuous acquisition
+def set_run(os_file):
+    _send_command(os_file, ":RUN")
+
+
+# Arm a single acquisition; the scope stops once it has triggered
+def set_single(os_file):
+    _send_command(os_file, ":SING")
+
+
+# Get the trigger status, e.g. RUN, STOP, T'D, WAIT or AUTO
+def get_trigger_status(os_file):
+    return _send_command(os_file, ":TRIG:STAT?", 20).decode('ascii').strip()
+
+
+# Wait until an armed acquisition has completed and the scope stopped
+def wait_for_stop(os_file, timeout=5.0, poll_interval=0.005):
+    deadline = timer() + timeout
+    while get_trigger_status(os_file) != 'STOP':
+        if timer() > deadline:
+            raise IOError('timed out waiting for the scope to trigger')
+        sleep(poll_interval)
+
+
 # Switch from remote (rmt) control back to local control
 def set_local(os_file):
     _send_command(os_file, ":KEY:FORC")
@@ -91,13 +564,33 @@ def get_channel_state(os_file, ch_num):
     return int(_send_command(os_file, ":CHAN" + str(ch_num) + ":DISP?", 20))
 
 
-# Get the channel data
-def get_points(os_file, waveform_pnts_mode, ch_num):
+# Get the channel data.  With a buffer from new_points_buffer() the samples are read into it
+# and the points returned are a view of it, valid until the buffer is used again.
+def get_points(os_file, waveform_pnts_mode, ch_num, buffer=None):
+    if not _timing['enabled']:
+        return _get_points(os_file, waveform_pnts_mode, ch_num, buffer)
+    # timed as a whole too: its commands plus the copy, counted as read time
+    _spans.timings = span = []
+    start = timer()
+    try:
+        return _get_points(os_file, waveform_pnts_mode, ch_num, buffer)
+    finally:
+        _spans.timings = None
+        lock_wait, sleep_time, write_time = [sum(t[i] for t in span) for i in (2, 3, 4)]
+        _record(os_file, CommandTiming('get_points', start, lock_wait, sleep_time, write_time,
+                                       timer() - start - lock_wait - sleep_time - write_time,
+                                       sum(t.bytes_written for t in span), sum(t.bytes_read for t in span)))
+
+
+def _get_points(os_file, waveform_pnts_mode, ch_num, buffer):
     _send_command(os_file, ":WAV:POIN:MODE " + waveform_pnts_mode)
-    raw_data = _send_command(os_file, ":WAV:DATA? CHAN"
-                             + str(ch_num), 1048586)  # 1048576 + 10 header
-    points = np.frombuffer(raw_data, 'B')
-    return points[10:]
+    if buffer is not None:
+        return _send_command(os_file, ":WAV:DATA? CHAN" + str(ch_num), buffer=buffer)
+    buffer = new_points_buffer()
+    points = _send_command(os_file, ":WAV:DATA? CHAN" + str(ch_num), buffer=buffer)
+    if len(points) < len(buffer) // 2:
+        points = points.copy()  # don't keep a 1M point buffer alive for a short capture
+    return points
 
 
 # Get the channel volts-per-division
@@ -132,7 +625,10 @@ def get_vpp(os_file, ch_num):
 
 # Get the channel Vamp
 def get_vamp(os_file, ch_num):
-    vamp = float(_send_command(os_file, ":MEAS:VAMP? CHAN" + str(ch_num), 20))
+    return _parse_vamp(_send_command(os_file, ":MEAS:VAMP? CHAN" + str(ch_num), 20))
+
+
+def _parse_vamp(vamp):
     try:
         vamp = float(vamp)
         if vamp > 1E9:  # assumed to be an error
@@ -149,7 +645,10 @@ def get_vrms(os_file, ch_num):
     
 # Get the channel Freq
 def get_freq(os_file, ch_num):
-    freq = _send_command(os_file, ":MEAS:FREQ? CHAN" + str(ch_num), 20)
+    return _parse_freq(_send_command(os_file, ":MEAS:FREQ? CHAN" + str(ch_num), 20))
+
+
+def _parse_freq(freq):
     try:
         freq = float(freq)
         if freq > 1E9:  # assumed to be an error
@@ -158,11 +657,15 @@ def get_freq(os_file, ch_num):
         freq = '********'
     return freq
 
-  
+
 # Get the channel Duty Cycle
 def get_duty_cycle(os_file, ch_num):
     pdut = _send_command(os_file, ":MEAS:PDUT? CHAN" + str(ch_num), 20)
     ndut = _send_command(os_file, ":MEAS:NDUT? CHAN" + str(ch_num), 20)
+    return _parse_duty_cycle(pdut, ndut)
+
+
+def _parse_duty_cycle(pdut, ndut):
     try:
         pdut = float(pdut)
         ndut = float(ndut)
@@ -176,3 +679,126 @@ def get_duty_cycle(os_file, ch_num):
         pdut = '***'
         ndut = '***'
     return str(pdut) + '/' + str(ndut)
+
+
+# Measurements of one channel, parsed the same way as the individual get_* functions above
+Measurements = namedtuple('Measurements', ['vmax', 'vmin', 'vpp', 'vamp', 'vrms', 'freq', 'duty_cycle'])
+
+MEASUREMENTS = ['VMAX', 'VMIN', 'VPP', 'VAMP', 'VRMS', 'FREQ', 'PDUT', 'NDUT']
+
+
+# Get all channel measurements in one round trip by chaining the queries with ';'.
+# Falls back to one query per measurement if the scope doesn't answer with eight values it
+# can parse, and keeps doing so for that device rather than waiting out a timeout on every
+# capture.
+def get_measurements(os_file, ch_num):
+    state = _device_state(os_file)
+    if state.chain_measurements:
+        try:
+            values = _send_command(os_file, _measurements_query(ch_num), 40 * len(MEASUREMENTS)).split(b';')
+            if len(values) == len(MEASUREMENTS):
+                return _parse_measurements(values)
+        except (OSError, ValueError):  # usbtmc read timed out or the answer is garbled
+            pass
+        state.chain_measurements = False
+    return _parse_measurements([_send_command(os_file, query, 20) for query in _measurement_queries(ch_num)])
+
+
+def _measurement_queries(ch_num):
+    return [":MEAS:" + name + "? CHAN" + str(ch_num) for name in MEASUREMENTS]
+
+
+def _measurements_query(ch_num):
+    return ";".join(_measurement_queries(ch_num))
+
+
+def _parse_measurements(values):
+    vmax, vmin, vpp, vamp, vrms, freq, pdut, ndut = values
+    return Measurements(float(vmax), float(vmin), float(vpp), _parse_vamp(vamp), float(vrms),
+                        _parse_freq(freq), _parse_duty_cycle(pdut, ndut))
+
+
+# Settings that only change when the front panel (or a set command) changes them
+ScopeSettings = namedtuple('ScopeSettings', ['time_per_division', 'time_offset', 'channels'])
+ChannelSettings = namedtuple('ChannelSettings', ['state', 'volts_div', 'vert_offset', 'sample_rate'])
+
+
+# The time base and the state of every channel, and scale, offset and sample rate of the
+# channels that are on only, so channels that are off cost one :DISP? each
+def _state_queries(num_channels):
+    return [":TIM:SCAL?", ":TIM:OFFS?"] + [":CHAN" + str(ch_num) + ":DISP?"
+                                           for ch_num in range(1, num_channels + 1)]
+
+
+def _channel_settings_queries(ch_nums):
+    queries = []
+    for ch_num in ch_nums:
+        chan = str(ch_num)
+        queries += [":CHAN" + chan + ":SCAL?", ":CHAN" + chan + ":OFFS?", ":ACQ:SAMP? CHAN" + chan]
+    return queries
+
+
+# The answer to the state queries and the channel numbers that are on, from the answer to the
+# state queries chained with the settings of ch_nums.  (None, None) if the scope didn't answer
+# them all.
+def _split_states(response, num_channels, ch_nums):
+    values = response.split(b';')
+    num_states = len(_state_queries(num_channels))
+    if len(values) != num_states + 3 * len(ch_nums):
+        return None, None
+    active = [ch_num for ch_num in range(1, num_channels + 1) if int(values[1 + ch_num])]
+    return b';'.join(values[:num_states]), active
+
+
+# The answers to both passes as one response, or None if the second is incomplete
+def _join_settings(states, queries, response):
+    if len(queries) == 0:
+        return states
+    if len(response.split(b';')) != len(queries):
+        return None
+    return states + b';' + response
+
+
+# Get all settings as the raw response, so it can be compared with an earlier one.  The
+# settings of ch_nums, the channels expected to be on (e.g. at the last capture), are asked
+# for along with the states, so this takes one round trip unless channels were switched on
+# or off.  Returns None if the scope doesn't answer every query with a value parse_settings
+# accepts, and from then on for that device rather than waiting out a timeout on every capture.
+def get_settings_response(os_file, num_channels, ch_nums=()):
+    state = _device_state(os_file)
+    if not state.chain_settings:
+        return None
+    ch_nums = list(ch_nums)
+    try:
+        queries = _state_queries(num_channels) + _channel_settings_queries(ch_nums)
+        response = _send_command(os_file, ";".join(queries), 20 * len(queries))
+        states, active = _split_states(response, num_channels, ch_nums)
+        if states is not None and active != ch_nums:
+            queries = _channel_settings_queries(active)
+            response = b''
+            if len(queries) > 0:
+                response = _send_command(os_file, ";".join(queries), 20 * len(queries))
+            response = _join_settings(states, queries, response)
+        if response is not None:
+            parse_settings(response, num_channels)
+    except (OSError, ValueError):  # usbtmc read timed out or an answer is garbled
+        states = response = None
+    if states is None or response is None:
+        state.chain_settings = False
+        return None
+    return response
+
+
+def parse_settings(response, num_channels):
+    values = response.split(b';')
+    channels = []
+    index = 2 + num_channels  # of the first channel's settings
+    for state in values[2:2 + num_channels]:
+        state = int(state)
+        if state:
+            volts_div, vert_offset, sample_rate = values[index:index + 3]
+            channels.append(ChannelSettings(state, float(volts_div), float(vert_offset), float(sample_rate)))
+            index += 3
+        else:
+            channels.append(ChannelSettings(state, 0.0, 0.0, 0.0))
+    return ScopeSettings(float(values[0]), float(values[1]), channels)
@@ -20,18 +20,70 @@
 
 import numpy as np
 import rigolusb
+import scope_decimate
+import scope_measure
 import datetime
+import threading
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
 SAMPLES = 'samples'
 UNITS = 'units'
 
+# How DS1000.stream re-arms the scope between frames
+SINGLE = 'single'  # :SINGle, wait for the trigger, read
+RUN = 'run'        # leave the scope running and read what it has (stops briefly in RAW mode)
+
+# How DS1000 caches settings (time base, channel state, scale, offset and sample rate).
+# PROBE reads them all on every capture in one chained query (two when channels were switched
+# on or off) and parses them again only if the answer changed.  It saves round trips, not
+# the reading itself.
+PROBE = 'probe'
+# TRUST reads them once and reuses them until invalidate_settings(), the only mode where
+# captures skip reading settings.
+TRUST = 'trust'
+
+# Where DS1000 gets Vmax, Vmin, Vpp, Vamp, Vrms, Freq and Duty from
+SCOPE_MEASUREMENTS = 'scope'    # :MEAS queries, measured on the 600 points on screen
+CLIENT_MEASUREMENTS = 'client'  # scope_measure, computed from the whole record
+
+# Default limits of DS1000.enable_history
+HISTORY_FRAMES = 100
+HISTORY_BYTES = 256 * 1024 * 1024
+
+
+# Point counts the way the scope shows them, e.g. 8K or 1M
+def abbreviate_points(num_points):
+    if num_points == 600:
+        return '600'
+    elif num_points == 8192:
+        return '8K'
+    elif num_points == 16384:
+        return '16K'
+    elif num_points == 524288:
+        return '512K'
+    elif num_points == 1048576:
+        return '1M'
+    return str(num_points)
+
 
 class DS1000(object):
     """ Represents the scope itself and has multiple channels """
-    
+
+    _timings = None  # command timings of the last query_scope, see rigolusb.enable_timing
+    _settings_cache = PROBE
+    _settings_response = None
+    _settings = None
+    _measurement_source = SCOPE_MEASUREMENTS
+    _history = None
+    _time_base_key = None  # what the time axis was computed from
+
     def __init__(self, device_path, num_channels):
         self._device_path = device_path
         self._os_file = None
+        self._session = None
         self._num_channels = num_channels
         self._channels = []
         self._active_channels = []
@@ -47,35 +99,269 @@ class DS1000(object):
         for i in range(num_channels):
             self._channels.append(Channel(i+1))
 
-    def query_scope(self, _waveform_pnts_mode='NOR'):
+    def __enter__(self):
+        self.open_session()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_session()
+
+    def __getstate__(self):
+        # open sessions aren't saved along with the scope data
+        state = self.__dict__.copy()
+        state['_session'] = None
+        state['_history'] = None
+        return state
+
+    # Keep the device open so repeated query_scope calls skip the open, *IDN? and close
+    def open_session(self):
+        if self._session is None:
+            self._session = rigolusb.Session(self._device_path).open()
+        return self._session
+
+    def close_session(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    # Select PROBE or TRUST settings caching, or None to query every setting on its own
+    def cache_settings(self, mode=PROBE):
+        if mode not in (PROBE, TRUST, None):
+            raise ValueError('unknown settings cache mode: ' + str(mode))
+        self._settings_cache = mode
+        self.invalidate_settings()
+
+    # Forget cached settings, e.g. after changing them on the front panel in TRUST mode
+    def invalidate_settings(self):
+        self._settings_response = None
+        self._settings = None
+
+    # Select SCOPE_MEASUREMENTS or CLIENT_MEASUREMENTS.  Client measurements save eight
+    # :MEAS queries per channel.
+    def set_measurements(self, source):
+        if source not in (SCOPE_MEASUREMENTS, CLIENT_MEASUREMENTS):
+            raise ValueError('unknown measurement source: ' + str(source))
+        self._measurement_source = source
+
+    # Keep the last captures of query_scope and stream in a History, see history
+    def enable_history(self, max_frames=HISTORY_FRAMES, max_bytes=HISTORY_BYTES):
+        self._history = History(max_frames, max_bytes)
+        return self._history
+
+    def disable_history(self):
+        self._history = None
+
+    # Settings from the cache, or None if they have to be queried one by one
+    def _cached_settings(self, os_file):
+        if self._needs_settings_query():
+            return self._update_settings(rigolusb.get_settings_response(os_file, self._num_channels,
+                                                                        self._expected_channels()))
+        return self._settings
+
+    # Channels that were on at the last capture, whose settings are read along with the states
+    def _expected_channels(self):
+        return [ch.ch_num for ch in self._active_channels]
+
+    def _needs_settings_query(self):
+        if self._settings_cache == TRUST:
+            return self._settings is None
+        return self._settings_cache == PROBE
+
+    def _update_settings(self, response):
+        if response is None:  # the scope didn't answer the combined query
+            self.invalidate_settings()
+            return None
+        if response != self._settings_response:
+            self._settings = rigolusb.parse_settings(response, self._num_channels)
+            self._settings_response = response
+        return self._settings
+
+    # Set the time base from the cached settings or by querying it, and return the
+    # settings for each channel (None where the channel has to query its own)
+    def _load_time_base(self, os_file):
+        settings = self._cached_settings(os_file)
+        if settings is None:
+            self._time_per_division = rigolusb.get_time_per_division(os_file)
+            self._time_offset = rigolusb.get_time_offset(os_file)
+            return [None] * self._num_channels
+        self._time_per_division = settings.time_per_division
+        self._time_offset = settings.time_offset
+        return settings.channels
+
+    def query_scope(self, _waveform_pnts_mode='NOR', session=None):
+        """ Captures all channels.  Uses session (or the one from open_session) when given,
+            otherwise opens the device for this capture only.  Each channel reads into the
+            same buffer every time, so copy raw_points that have to outlive the next capture. """
         self._waveform_pnts_mode = _waveform_pnts_mode
-        self._os_file = rigolusb.open_device_file(self._device_path)
-        rigolusb.set_stop(self._os_file)
-        self._retrieval_date = datetime.datetime.now()
-        self._id = rigolusb.get_id(self._os_file)
-        self._time_per_division = rigolusb.get_time_per_division(self._os_file)
-        self._time_offset = rigolusb.get_time_offset(self._os_file)
+        session = session or self._session
+        own_session = session is None
+        if own_session:
+            session = rigolusb.Session(self._device_path).open()
+        recorder = None
+        if rigolusb.timing_enabled():
+            recorder = rigolusb.start_recording(session.os_file)
+        self._timings = recorder
+        try:
+            self._os_file = session.os_file
+            rigolusb.set_stop(self._os_file)
+            self._retrieval_date = datetime.datetime.now()
+            self._id = session.id
+            channel_settings = self._load_time_base(self._os_file)
+            self._active_channels = []
+            for ch, ch_settings in zip(self._channels, channel_settings):
+                ch.load_channel_data(self._os_file, self._waveform_pnts_mode, ch_settings,
+                                     self._measurement_source == SCOPE_MEASUREMENTS)
+                if ch.state == 1:
+                    self._active_channels.append(ch)
+        finally:
+            if recorder is not None:
+                rigolusb.stop_recording(recorder)
+            if own_session:
+                session.close()
+        self._update_time_base()
+        if self._history is not None:
+            self._history.append(self)
+
+    def _update_time_base(self):
+        if self.num_active_channels > 0:
+            ch = self._active_channels[0]
+            self._set_time_base(ch.num_points, ch.sample_rate)
+        else:
+            self._set_time_base(0, 0)
+
+    # All channels share one time axis.  It's computed once and then handed out by reference
+    # (read-only) to every channel, frame and capture until the time base changes.
+    def _set_time_base(self, num_points, sample_rate):
+        self._points_per_channel = num_points
+        self._samplerate_per_channel = sample_rate
+        self._time_units = self._calc_time_base()[2] if num_points > 0 else '(sec)'
+        key = (num_points, sample_rate, self._time_per_division, self._time_offset)
+        if key != self._time_base_key:
+            self._time_base_key = key
+            self._time_axis = None  # computed when first used
+
+    # Fill in a scope from saved settings, see scope_capture
+    def _restore(self, settings):
+        self._device_path = settings['device_path']
+        self._id = settings['id']
+        self._retrieval_date = settings['retrieval_date']
+        self._waveform_pnts_mode = settings['waveform_pnts_mode']
+        self._time_per_division = settings['time_per_division']
+        self._time_offset = settings['time_offset']
+        self._active_channels = [ch for ch in self._channels if ch.state == 1]
+        self._update_time_base()
+
+    def stream(self, _waveform_pnts_mode='NOR', count=None, ring_size=3, rearm=SINGLE, drop=False,
+               timeout=5.0):
+        """ Yields Frames as fast as the scope delivers them, count frames or forever when None.
+
+            Channel settings are read once up front and only waveform data is fetched per frame.
+            A background thread acquires into a ring of ring_size reusable Frames, so a Frame
+            is only valid until the next one is requested.  When the consumer falls behind the
+            thread waits for a free Frame, or with drop=True reuses the oldest unread one. """
+        self._waveform_pnts_mode = _waveform_pnts_mode
+        session = self._session
+        own_session = session is None
+        if own_session:
+            session = rigolusb.Session(self._device_path).open()
+        free = queue.Queue()
+        ready = queue.Queue()
+        stop = threading.Event()
+        thread = None
+        try:
+            os_file = session.os_file
+            self._load_settings(session)
+            for i in range(max(ring_size, 1)):
+                free.put(Frame())
+
+            def produce():
+                try:
+                    if rearm == RUN:
+                        rigolusb.set_run(os_file)
+                    index = 0
+                    dropped = 0
+                    while count is None or index < count:
+                        frame = None
+                        while frame is None and not stop.is_set():
+                            if drop:
+                                try:
+                                    frame = free.get_nowait()
+                                except queue.Empty:
+                                    try:
+                                        frame = ready.get_nowait()
+                                        dropped += 1
+                                    except queue.Empty:
+                                        pass
+                            if frame is None:
+                                try:
+                                    frame = free.get(timeout=0.1)
+                                except queue.Empty:
+                                    pass
+                        if frame is None:
+                            break
+                        self._acquire_frame(os_file, frame, rearm, timeout)
+                        frame._index = index
+                        frame._dropped = dropped
+                        index += 1
+                        ready.put(frame)
+                    ready.put(None)
+                except Exception as e:
+                    ready.put(e)
+
+            thread = threading.Thread(target=produce, name='DS1000.stream')
+            thread.daemon = True
+            thread.start()
+            while True:
+                frame = ready.get()
+                if frame is None:
+                    break
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+                free.put(frame)
+        finally:
+            stop.set()
+            if thread is not None:
+                thread.join()
+            if own_session:
+                session.close()
+
+    def _load_settings(self, session):
+        os_file = session.os_file
+        rigolusb.set_stop(os_file)
+        self._id = session.id
+        channel_settings = self._load_time_base(os_file)
         self._active_channels = []
-        for ch in self._channels:
-            ch.load_channel_data(self._os_file, self._waveform_pnts_mode)
+        for ch, ch_settings in zip(self._channels, channel_settings):
+            ch.load_channel_settings(os_file, ch_settings)
             if ch.state == 1:
                 self._active_channels.append(ch)
-        rigolusb.set_local(self._os_file)
-        rigolusb.close_device_file(self._os_file)
+        self._points_per_channel = 0
+
+    def _acquire_frame(self, os_file, frame, rearm, timeout):
+        if rearm == SINGLE:
+            rigolusb.set_single(os_file)
+            rigolusb.wait_for_stop(os_file, timeout)
+        elif self._waveform_pnts_mode != 'NOR':
+            rigolusb.set_stop(os_file)
+        frame._retrieval_date = datetime.datetime.now()
+        for ch in self._active_channels:
+            frame._store(ch, rigolusb.get_points(os_file, self._waveform_pnts_mode, ch.ch_num,
+                                                 frame._buffer(ch.ch_num)))
+        if rearm == RUN and self._waveform_pnts_mode != 'NOR':
+            rigolusb.set_run(os_file)
         if self.num_active_channels > 0:
             ch = self._active_channels[0]
-            self._points_per_channel = ch.num_points
-            self._samplerate_per_channel = ch.sample_rate
-            res = self._calc_time_axis()
-            self._time_axis = res[0]
-            self._time_units = res[1]
-        else:
-            self._points_per_channel = 0
-            self._samplerate_per_channel = 0
-            self._time_axis = []
-            self._time_units = '(sec)'
+            num_points = len(frame.raw_points[ch.ch_num])
+            if num_points != self._points_per_channel:
+                self._set_time_base(num_points, ch.sample_rate)
+        frame._time_axis = self.time_axis
+        if self._history is not None:
+            self._history.append(self, frame)
 
-    def _calc_time_axis(self):
+    # First and last time of the axis (the axis is a linspace between them) plus the units
+    # label and the factor that scales seconds to those units
+    def _calc_time_base(self):
         if self._points_per_channel == 600:
             time_step = self.time_per_division / 50.0
             x_low = (self.time_per_division * -6) + self.time_offset
@@ -84,24 +370,41 @@ class DS1000(object):
             time_step = 1.0 / self._samplerate_per_channel
             x_low = -((self._points_per_channel / 2.0) * time_step) + self.time_offset
             x_high = ((self._points_per_channel - 1) * time_step) + x_low
-        time_axis = np.linspace(x_low, (x_high + time_step), self._points_per_channel)
 
         # Adjust time scale units
         time_avg = (x_high + abs(x_low)) / 2.0
-        time_label = '(sec)'
         if time_avg >= 1:
-            pass
+            return x_low, x_high + time_step, '(sec)', 1
         elif time_avg >= 0.001:
-            time_axis *= 1000
-            time_label = '(ms)'
+            return x_low, x_high + time_step, '(ms)', 1000
         elif time_avg >= 0.000001:
-            time_axis *= 1000000
-            time_label = '(us)'
-        else:
-            time_axis *= 1000000000
-            time_label = '(ns)'
+            return x_low, x_high + time_step, '(us)', 1000000
+        return x_low, x_high + time_step, '(ns)', 1000000000
+
+    def _calc_time_axis(self):
+        first, last, time_label, scale = self._calc_time_base()
+        time_axis = np.linspace(first, last, self._points_per_channel)
+        if scale != 1:
+            time_axis *= scale
         return [time_axis, time_label]
 
+    def get_time_axis(self, start=None, stop=None, dtype=np.float64):
+        """ Times of samples [start:stop] in time_axis units.  Slices of the cached full axis
+            when it has been computed, otherwise only the requested range is computed. """
+        dtype = np.dtype(dtype)
+        if self._time_axis is not None and dtype == np.float64:
+            return self.time_axis[SAMPLES][start:stop]
+        if self._points_per_channel == 0:
+            return np.asarray([], dtype=dtype)
+        start, stop, stride = slice(start, stop).indices(self._points_per_channel)
+        first, last, time_label, scale = self._calc_time_base()
+        step = (last - first) / max(self._points_per_channel - 1, 1)
+        time_axis = np.arange(start, stop, dtype=np.float64)
+        time_axis *= step
+        time_axis += first
+        time_axis *= scale
+        return time_axis.astype(dtype, copy=False)
+
     def get_channel(self, ch_num):
         return self._channels[ch_num-1]
 
@@ -129,6 +432,16 @@ class DS1000(object):
     def retrieval_date(self):
         return self._retrieval_date
 
+    # The History of recent captures, None unless enable_history was called
+    @property
+    def history(self):
+        return self._history
+
+    # rigolusb.Timings of the commands sent by the last query_scope, None unless timing was enabled
+    @property
+    def timings(self):
+        return self._timings
+
     @property
     def waveform_pnts_mode(self):
         return self._waveform_pnts_mode
@@ -147,6 +460,9 @@ class DS1000(object):
 
     @property
     def time_axis(self):
+        if self._time_axis is None:
+            self._time_axis = self._calc_time_axis()[0] if self._points_per_channel > 0 else np.asarray([])
+            self._time_axis.flags.writeable = False
         return {SAMPLES: self._time_axis, UNITS: self._time_units}
 
     @property
@@ -161,6 +477,13 @@ class DS1000(object):
 class Channel(object):
     """ Represents one channel on an oscilloscope """
 
+    # class defaults so channels saved before these existed still load
+    _pyramid = None
+    _volt_points_f32 = None
+    _measurements = None
+    _pending_measures = False  # Vmax, Vmin, ... still to be computed with scope_measure
+    _buffer = None
+
     def __init__(self, ch_num):
         self._ch_num = ch_num
         self._state = 0
@@ -178,42 +501,65 @@ class Channel(object):
         self._measures_string = ''
         self._num_points_abbr = ''
         self._volt_points = []
-        
-    def load_channel_data(self, _os_file, _waveform_pnts_mode):
-        self._state = rigolusb.get_channel_state(_os_file, self._ch_num)
-        if self._state:
-            self._raw_points = rigolusb.get_points(_os_file, _waveform_pnts_mode, self._ch_num)
-            self._volts_div = rigolusb.get_volts_div(_os_file, self._ch_num)
-            self._vert_offset = rigolusb.get_vertical_offset(_os_file, self._ch_num)
-            self._sample_rate = rigolusb.get_sample_rate(_os_file, self._ch_num)
-            self._vmax = rigolusb.get_vmax(_os_file, self._ch_num)
-            self._vmin = rigolusb.get_vmin(_os_file, self._ch_num)
-            self._vpp = rigolusb.get_vpp(_os_file, self._ch_num)
-            self._vamp = rigolusb.get_vamp(_os_file, self._ch_num)
-            self._vrms = rigolusb.get_vrms(_os_file, self._ch_num)
-            self._freq = rigolusb.get_freq(_os_file, self._ch_num)
-            self._duty_cycle = rigolusb.get_duty_cycle(_os_file, self._ch_num)
-            self._measures_string = ('Vmax=' + str(self._vmax) + 'V' + ',  ' +
-                                     'Vmin=' + str(self._vmin) + 'V' + ',  ' +
-                                     'Vrms=' + str(self._vrms) + 'V' + ',  ' +
-                                     'Vamp=' + str(self._vamp) + 'V' + ',  ' +
-                                     'Freq=' + str(self._freq) + 'Hz' + ',  ' +
-                                     'Duty=' + str(self._duty_cycle) + '%')
-            if self.num_points == 600:
-                self._num_points_abbr = '600'
-            elif self.num_points == 8192:
-                self._num_points_abbr = '8K'
-            elif self.num_points == 16384:
-                self._num_points_abbr = '16K'
-            elif self.num_points == 524288:
-                self._num_points_abbr = '512K'
-            elif self.num_points == 1048576:
-                self._num_points_abbr = '1M'
-            else:
-                self._num_points_abbr = str(self.num_points)
+        self._pyramid = None
+        self._measurements = None
+
+    # With settings (a rigolusb.ChannelSettings, e.g. from the settings cache) only the
+    # waveform and measurements are queried.  Without measure_on_scope the measurements are
+    # computed by scope_measure instead.
+    def load_channel_data(self, _os_file, _waveform_pnts_mode, settings=None, measure_on_scope=True):
+        if settings is None:
+            settings = self._query_settings(_os_file)
+        if settings.state:
+            raw_points = rigolusb.get_points(_os_file, _waveform_pnts_mode, self._ch_num, self._points_buffer())
+            measures = None
+            if measure_on_scope:
+                measures = rigolusb.get_measurements(_os_file, self._ch_num)
+            self._set_data(settings.state, raw_points, settings.volts_div, settings.vert_offset,
+                           settings.sample_rate, measures)
+        else:
+            self._set_data(settings.state)
+
+    def __getstate__(self):
+        # the read buffer isn't saved along with the channel data
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        return state
 
-            self._volt_points = 5 * self._volts_div - 0.04 * self._volts_div * self._raw_points - self._vert_offset
+    # Read buffer reused for this channel's samples by every capture, like Frame's
+    def _points_buffer(self):
+        if self._buffer is None:
+            self._buffer = rigolusb.new_points_buffer()
+        return self._buffer
+
+    def _query_settings(self, _os_file):
+        state = rigolusb.get_channel_state(_os_file, self._ch_num)
+        if not state:
+            return rigolusb.ChannelSettings(state, 0.0, 0.0, 0.0)
+        return rigolusb.ChannelSettings(state, rigolusb.get_volts_div(_os_file, self._ch_num),
+                                        rigolusb.get_vertical_offset(_os_file, self._ch_num),
+                                        rigolusb.get_sample_rate(_os_file, self._ch_num))
+
+    # Store what load_channel_data (or scope_async) read from the scope.  Measurements are
+    # computed with scope_measure when measures is None, the first time they are used.
+    def _set_data(self, state, raw_points=None, volts_div=0.0, vert_offset=0.0, sample_rate=0.0,
+                  measures=None):
+        self._pyramid = None
+        self._measurements = None
+        self._state = state
+        if self._state:
+            self._raw_points = raw_points
+            self._volts_div = volts_div
+            self._vert_offset = vert_offset
+            self._sample_rate = sample_rate
+            self._volt_points = None  # computed when first used
+            self._volt_points_f32 = None
+            self._pending_measures = measures is None
+            if measures is not None:
+                self._set_measures(measures)
+            self._num_points_abbr = abbreviate_points(self.num_points)
         else:
+            self._pending_measures = False
             self._raw_points = np.asarray([])
             self._volts_div = 0.0
             self._vert_offset = 0.0
@@ -228,6 +574,101 @@ class Channel(object):
             self._measures_string = ''
             self._num_points_abbr = ''
             self._volt_points = []
+            self._volt_points_f32 = None
+
+    def _set_measures(self, measures):
+        self._pending_measures = False
+        self._vmax = measures.vmax
+        self._vmin = measures.vmin
+        self._vpp = measures.vpp
+        self._vamp = measures.vamp
+        self._vrms = measures.vrms
+        self._freq = measures.freq
+        self._duty_cycle = measures.duty_cycle
+        self._measures_string = self._calc_measures_string()
+
+    # Compute the measurements _set_data left to scope_measure, which needs the volts
+    def _load_measures(self):
+        if self._pending_measures:
+            self._set_measures(scope_measure.to_scope_measurements(self.measurements))
+
+    def _calc_measures_string(self):
+        return ('Vmax=' + str(self._vmax) + 'V' + ',  ' +
+                'Vmin=' + str(self._vmin) + 'V' + ',  ' +
+                'Vrms=' + str(self._vrms) + 'V' + ',  ' +
+                'Vamp=' + str(self._vamp) + 'V' + ',  ' +
+                'Freq=' + str(self._freq) + 'Hz' + ',  ' +
+                'Duty=' + str(self._duty_cycle) + '%')
+
+    # Fill in a channel from saved settings and samples, see scope_capture.  Volts are
+    # only computed when volt_points is first used.
+    def _restore(self, settings, raw_points):
+        self._state = settings['state']
+        self._raw_points = raw_points
+        self._volts_div = settings['volts_div']
+        self._vert_offset = settings['vert_offset']
+        self._sample_rate = settings['sample_rate']
+        self._vmax = settings['vmax']
+        self._vmin = settings['vmin']
+        self._vpp = settings['vpp']
+        self._vamp = settings['vamp']
+        self._vrms = settings['vrms']
+        self._freq = settings['freq']
+        self._duty_cycle = settings['duty_cycle']
+        self._pyramid = None
+        self._measurements = None
+        # measurements saved as None are computed with scope_measure when first used
+        self._pending_measures = bool(self._state) and settings['vmax'] is None
+        if self._state:
+            self._measures_string = '' if self._pending_measures else self._calc_measures_string()
+            self._num_points_abbr = abbreviate_points(self.num_points)
+            self._volt_points = None
+            self._volt_points_f32 = None
+        else:
+            self._measures_string = ''
+            self._num_points_abbr = ''
+            self._volt_points = []
+
+    # Only the settings needed to convert waveform data, used when streaming
+    def load_channel_settings(self, _os_file, settings=None):
+        if settings is None:
+            settings = self._query_settings(_os_file)
+        self._state = settings.state
+        if self._state:
+            self._volts_div = settings.volts_div
+            self._vert_offset = settings.vert_offset
+            self._sample_rate = settings.sample_rate
+
+    def _calc_volt_points(self, raw_points=None, dtype=np.float64):
+        if raw_points is None:
+            raw_points = self._raw_points
+        # 5 * volts_div - 0.04 * volts_div * raw - vert_offset, with a single allocation
+        volts = np.asarray(raw_points).astype(dtype)
+        volts *= dtype(-0.04 * self._volts_div)
+        volts += dtype(5 * self._volts_div - self._vert_offset)
+        return volts
+
+    def get_volts(self, start=None, stop=None, dtype=np.float64):
+        """ Volts of samples [start:stop] as float64 or float32.  Asking for the whole record
+            converts and caches it; a range is sliced from the cache when there is one and
+            otherwise converted on its own. """
+        dtype = np.dtype(dtype).type
+        if not self._state:
+            return np.asarray([], dtype=dtype)
+        if dtype is np.float32:
+            cached = self._volt_points_f32
+        else:
+            cached = self._volt_points
+        if cached is not None:
+            return cached[start:stop]
+        if start is None and stop is None:
+            volts = self._calc_volt_points(self._raw_points, dtype)
+            if dtype is np.float32:
+                self._volt_points_f32 = volts
+            else:
+                self._volt_points = volts
+            return volts
+        return self._calc_volt_points(self._raw_points[start:stop], dtype)
 
     @property
     def ch_num(self):
@@ -255,34 +696,42 @@ class Channel(object):
 
     @property
     def vmax(self):
+        self._load_measures()
         return self._vmax
 
     @property
     def vmin(self):
+        self._load_measures()
         return self._vmin
 
     @property
     def vpp(self):
+        self._load_measures()
         return self._vpp
 
     @property
     def vamp(self):
+        self._load_measures()
         return self._vamp
 
     @property
     def vrms(self):
+        self._load_measures()
         return self._vrms
     
     @property
     def freq(self):
+        self._load_measures()
         return self._freq
     
     @property
     def duty_cycle(self):
+        self._load_measures()
         return self._duty_cycle
 
     @property
     def meas_string(self):
+        self._load_measures()
         return self._measures_string
    
     @property
@@ -295,4 +744,307 @@ class Channel(object):
    
     @property
     def volt_points(self):
+        if self._volt_points is None:
+            return self.get_volts()
         return self._volt_points
+
+    # scope_measure.Measurements of the whole record (None while the channel is off),
+    # computed on first use
+    @property
+    def measurements(self):
+        if self._measurements is None and self._state:
+            self._measurements = scope_measure.measure_channel(self)
+        return self._measurements
+
+    # Min/max decimation levels over the samples, built on first use
+    @property
+    def pyramid(self):
+        if self._pyramid is None:
+            self._pyramid = scope_decimate.Pyramid(self._raw_points)
+        return self._pyramid
+
+
+class Frame(object):
+    """ One acquisition from DS1000.stream: the time axis and each active channel's data.
+        Frames are reused by the stream, so copy whatever is needed beyond the next frame.
+        Volts and measurements are computed when first asked for, by whichever thread
+        consumes the frame rather than the one acquiring it. """
+
+    def __init__(self):
+        self._index = 0
+        self._dropped = 0
+        self._retrieval_date = None
+        self._time_axis = {SAMPLES: [], UNITS: '(sec)'}
+        self._raw_points = {}
+        self._settings = {}
+        self._volt_points = {}   # conversion buffer per channel, reused
+        self._converted = set()  # channels whose buffer holds the volts of this acquisition
+        self._measurements = {}
+        self._buffers = {}
+
+    # Read buffer reused for a channel's samples every time this frame is filled
+    def _buffer(self, ch_num):
+        if ch_num not in self._buffers:
+            self._buffers[ch_num] = rigolusb.new_points_buffer()
+        return self._buffers[ch_num]
+
+    def _store(self, ch, raw_points):
+        self._raw_points[ch.ch_num] = raw_points
+        self._settings[ch.ch_num] = rigolusb.ChannelSettings(ch.state, ch.volts_div, ch.vert_offset, ch.sample_rate)
+        self._converted.discard(ch.ch_num)
+        self._measurements.pop(ch.ch_num, None)
+
+    def get_volts(self, ch_num):
+        if ch_num not in self._converted:
+            raw_points = self._raw_points[ch_num]
+            settings = self._settings[ch_num]
+            volts = self._volt_points.get(ch_num)
+            if volts is None or len(volts) != len(raw_points):
+                volts = np.empty(len(raw_points))
+                self._volt_points[ch_num] = volts
+            # same conversion as Channel._calc_volt_points, without temporaries
+            np.multiply(raw_points, -0.04 * settings.volts_div, out=volts)
+            volts += 5 * settings.volts_div - settings.vert_offset
+            self._converted.add(ch_num)
+        return self._volt_points[ch_num]
+
+    # rigolusb.ChannelSettings the channel's samples were acquired with
+    def settings(self, ch_num):
+        return self._settings[ch_num]
+
+    # scope_measure.Measurements of a channel's samples
+    def get_measurements(self, ch_num):
+        if ch_num not in self._measurements:
+            self._measurements[ch_num] = scope_measure.measure(self.get_volts(ch_num),
+                                                               self._settings[ch_num].sample_rate)
+        return self._measurements[ch_num]
+
+    @property
+    def index(self):
+        return self._index
+
+    # Number of frames the stream had discarded when this one was acquired
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def retrieval_date(self):
+        return self._retrieval_date
+
+    @property
+    def time_axis(self):
+        return self._time_axis
+
+    @property
+    def raw_points(self):
+        return self._raw_points
+
+    @property
+    def volt_points(self):
+        for ch_num in self._raw_points:
+            self.get_volts(ch_num)
+        return self._volt_points
+
+
+class History(object):
+    """ The last captures of a DS1000 (see DS1000.enable_history), kept as raw 8-bit samples
+        plus the settings needed to scale them, in one ring allocated on the first append.
+
+        The ring holds max_frames captures or as many as fit in max_bytes, whichever is
+        fewer.  All captures in it have the same active channels, point count and mode; a
+        capture that differs starts the history over.  Frames hand out views of the ring,
+        which stay valid until as many captures as it holds have been appended after them. """
+
+    def __init__(self, max_frames=HISTORY_FRAMES, max_bytes=HISTORY_BYTES):
+        if max_frames < 1:
+            raise ValueError('history needs room for at least one frame')
+        self._max_frames = max_frames
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._layout = None  # (channel numbers, points, mode) of the captures in the ring
+        self._id = ''
+        self._num_channels = 0
+        self._raw = np.empty((0, 0, 0), dtype=np.uint8)  # slot, channel, sample
+        self._dates = []
+        self._time_base = np.empty((0, 2))   # slot -> time per division, time offset
+        self._scaling = np.empty((0, 0, 3))  # slot, channel -> volts_div, vert_offset, sample_rate
+        self._start = 0   # index of the first capture since the history (re)started
+        self._first = 0   # of the oldest capture still held
+        self._count = 0   # of the next capture
+
+    def _allocate(self, layout):
+        ch_nums, num_points, mode = layout
+        frame_bytes = max(len(ch_nums) * num_points, 1)
+        slots = min(self._max_frames, self._max_bytes // frame_bytes)
+        if slots < 1:
+            raise ValueError('a ' + str(frame_bytes) + ' byte capture exceeds the history limit of ' +
+                             str(self._max_bytes) + ' bytes')
+        shape = (slots, len(ch_nums), num_points)
+        if self._raw.shape != shape:
+            self._raw = np.empty(shape, dtype=np.uint8)
+            self._dates = [None] * slots
+            self._time_base = np.empty((slots, 2))
+            self._scaling = np.empty((slots, len(ch_nums), 3))
+        self._layout = layout
+        self._start = self._first = self._count
+
+    def append(self, scp, frame=None):
+        """ Copies the samples of scp's active channels into the ring, or those of frame, a
+            Frame that scp streamed """
+        channels = scp.active_channels
+        if frame is None:
+            raw_points = [ch.raw_points for ch in channels]
+            retrieval_date = scp.retrieval_date
+        else:
+            raw_points = [frame.raw_points[ch.ch_num] for ch in channels]
+            retrieval_date = frame.retrieval_date
+        num_points = len(raw_points[0]) if raw_points else 0
+        layout = (tuple(ch.ch_num for ch in channels), num_points, scp.waveform_pnts_mode)
+        with self._lock:
+            if layout != self._layout:
+                self._allocate(layout)
+            slot = self._count % len(self._raw)
+            for i, points in enumerate(raw_points):
+                self._raw[slot, i] = points
+                self._scaling[slot, i] = (channels[i].volts_div, channels[i].vert_offset, channels[i].sample_rate)
+            self._time_base[slot] = (scp.time_per_division, scp.time_offset)
+            self._dates[slot] = retrieval_date
+            self._id = scp.id
+            self._num_channels = scp.num_channels
+            self._count += 1
+            self._first = max(self._first, self._count - len(self._raw))
+
+    def clear(self):
+        with self._lock:
+            self._first = self._count
+
+    def _slot(self, index):
+        return index % len(self._raw)
+
+    def __len__(self):
+        return self._count - self._first
+
+    def __getitem__(self, i):
+        """ The HistoryFrame i captures from the oldest held, or from the end when negative """
+        with self._lock:
+            length = self._count - self._first
+            if i < 0:
+                i += length
+            if not 0 <= i < length:
+                raise IndexError('history index out of range')
+            return HistoryFrame(self, self._first + i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # The most recent capture, None while the history is empty
+    def latest(self):
+        with self._lock:
+            if self._count == self._first:
+                return None
+            return HistoryFrame(self, self._count - 1)
+
+    @property
+    def capacity(self):
+        return len(self._raw)
+
+    @property
+    def nbytes(self):
+        return self._raw.nbytes
+
+    @property
+    def ch_nums(self):
+        return self._layout[0] if self._layout else ()
+
+    @property
+    def points_per_channel(self):
+        return self._layout[1] if self._layout else 0
+
+    @property
+    def waveform_pnts_mode(self):
+        return self._layout[2] if self._layout else ''
+
+    # Captures appended since the history (re)started, including those overwritten since
+    @property
+    def count(self):
+        return self._count - self._start
+
+
+class HistoryFrame(object):
+    """ One capture in a History.  Samples are views of the ring, see History. """
+
+    def __init__(self, history, index):
+        self._history = history
+        self._index = index
+        self._slot = history._slot(index)
+
+    # False once the capture has been overwritten (or the history started over), after which
+    # its data belong to a newer one
+    @property
+    def valid(self):
+        history = self._history
+        return self._index >= history._start and history._count - self._index <= history.capacity
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def retrieval_date(self):
+        return self._history._dates[self._slot]
+
+    @property
+    def time_per_division(self):
+        return float(self._history._time_base[self._slot, 0])
+
+    @property
+    def time_offset(self):
+        return float(self._history._time_base[self._slot, 1])
+
+    @property
+    def ch_nums(self):
+        return self._history.ch_nums
+
+    # Samples of all channels, one row per channel in ch_nums order
+    @property
+    def raw(self):
+        return self._history._raw[self._slot]
+
+    @property
+    def raw_points(self):
+        return dict(zip(self.ch_nums, self.raw))
+
+    def _channel_row(self, ch_num):
+        try:
+            return self.ch_nums.index(ch_num)
+        except ValueError:
+            raise KeyError('channel ' + str(ch_num) + ' was off')
+
+    # rigolusb.ChannelSettings of a channel that was on
+    def settings(self, ch_num):
+        volts_div, vert_offset, sample_rate = self._history._scaling[self._slot, self._channel_row(ch_num)]
+        return rigolusb.ChannelSettings(1, float(volts_div), float(vert_offset), float(sample_rate))
+
+    def get_volts(self, ch_num, dtype=np.float64):
+        dtype = np.dtype(dtype).type
+        settings = self.settings(ch_num)
+        # same conversion as Channel._calc_volt_points
+        volts = self.raw[self._channel_row(ch_num)].astype(dtype)
+        volts *= dtype(-0.04 * settings.volts_div)
+        volts += dtype(5 * settings.volts_div - settings.vert_offset)
+        return volts
+
+    def to_scope(self):
+        """ A DS1000 holding a copy of this capture, e.g. for scope_capture.save.  Its
+            measurements are computed with scope_measure. """
+        scp = DS1000('history', self._history._num_channels)
+        for ch_num in self.ch_nums:
+            settings = self.settings(ch_num)
+            scp.get_channel(ch_num)._set_data(1, np.array(self.raw[self._channel_row(ch_num)]),
+                                              settings.volts_div, settings.vert_offset, settings.sample_rate)
+        scp._restore({'device_path': 'history', 'id': self._history._id, 'retrieval_date': self.retrieval_date,
+                      'waveform_pnts_mode': self._history.waveform_pnts_mode,
+                      'time_per_division': self.time_per_division, 'time_offset': self.time_offset})
+        return scp
@@ -0,0 +1,149 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Measures every capture file (see scope_capture, scope_gui -o) in one or more directories
+# without a display, one CSV row per active channel of each capture.
+#
+#     python scope_analyze.py captures/ -o results.csv             Note: one process per core
+#     python scope_analyze.py captures/ -r -p '*.dat' -j 4 -s      Note: subdirectories too, with
+#                                                                        a summary per channel
+#
+# Files are measured in a pool of processes and rows are written as each file is done, so
+# only the files being worked on are in memory.  Shelve files saved before the capture format
+# are measured too; other files are reported on standard error.
+
+import sys
+import csv
+import argparse
+import multiprocessing
+import numpy as np
+import scope_capture
+import scope_measure
+
+CAPTURE_FIELDS = ['file', 'retrieval_date', 'id', 'waveform_pnts_mode', 'time_per_division',
+                  'time_offset', 'ch_num', 'num_points', 'sample_rate', 'volts_div', 'vert_offset']
+STATISTICS = ['vstd']
+FIELDS = CAPTURE_FIELDS + list(scope_measure.Measurements._fields) + STATISTICS
+
+
+# Rows for one capture file, or an error message.  Runs in the worker processes.
+def analyze_file(path):
+    try:
+        scp = scope_capture.open_scope(path)
+        channels = scp.active_channels
+        rows = []
+        for ch, m in zip(channels, scope_measure.measure_channels(channels)):
+            row = {'file': path, 'retrieval_date': scp.retrieval_date.isoformat(), 'id': scp.id.strip(),
+                   'waveform_pnts_mode': scp.waveform_pnts_mode, 'time_per_division': scp.time_per_division,
+                   'time_offset': scp.time_offset, 'ch_num': ch.ch_num, 'num_points': ch.num_points,
+                   'sample_rate': ch.sample_rate, 'volts_div': ch.volts_div, 'vert_offset': ch.vert_offset,
+                   'vstd': float(np.std(ch.volt_points))}
+            row.update(m._asdict())
+            rows.append(row)
+        return path, rows, None
+    except Exception as e:
+        return path, [], str(e)
+
+
+class Summary(object):
+    """ Running count, mean, min and max of every measurement per channel number """
+
+    def __init__(self):
+        self._stats = {}  # (ch_num, field) -> [count, total, min, max]
+
+    def add(self, row):
+        for field in scope_measure.Measurements._fields + tuple(STATISTICS):
+            value = row[field]
+            if np.isnan(value):
+                continue
+            key = (row['ch_num'], field)
+            if key not in self._stats:
+                self._stats[key] = [0, 0.0, value, value]
+            stats = self._stats[key]
+            stats[0] += 1
+            stats[1] += value
+            stats[2] = min(stats[2], value)
+            stats[3] = max(stats[3], value)
+
+    def lines(self):
+        lines = ['%-4s %-10s %8s %14s %14s %14s' % ('ch', 'field', 'count', 'mean', 'min', 'max')]
+        for ch_num, field in sorted(self._stats):
+            count, total, low, high = self._stats[(ch_num, field)]
+            lines.append('%-4d %-10s %8d %14.6g %14.6g %14.6g' % (ch_num, field, count, total / count, low, high))
+        return lines
+
+
+# csv needs newline='' on Python 3 and a binary file on Python 2
+def open_csv(path):
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def analyze(paths, output, jobs=None, chunksize=4, summary=None, errors=sys.stderr):
+    """ Measures the captures in paths and writes their rows to the file object output as
+        CSV.  Returns the number of files measured. """
+    writer = csv.DictWriter(output, FIELDS)
+    writer.writeheader()
+    count = 0
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for path, rows, error in pool.imap(analyze_file, paths, chunksize):
+            if error is not None:
+                errors.write(path + ': ' + error + '\n')
+                continue
+            writer.writerows(rows)
+            if summary is not None:
+                for row in rows:
+                    summary.add(row)
+            count += 1
+    finally:
+        pool.close()
+        pool.join()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure a directory of scope capture files')
+    parser.add_argument('directories', help='directories holding capture files', nargs='+')
+    parser.add_argument('-o', '--output', help='CSV file to write, default is standard output', default='')
+    parser.add_argument('-p', '--pattern', help='file name pattern, e.g. "*.dat"', default='*')
+    parser.add_argument('-r', '--recursive', help='include subdirectories', action='store_true')
+    parser.add_argument('-j', '--jobs', help='worker processes, default is one per core', type=int, default=None)
+    parser.add_argument('-c', '--chunksize', help='files handed to a worker at a time', type=int, default=4)
+    parser.add_argument('-s', '--summary', help='print statistics per channel to standard error', action='store_true')
+    args = parser.parse_args()
+
+    # files that aren't captures are passed on too so they are reported rather than skipped
+    paths = scope_capture.find_captures(args.directories, args.pattern, args.recursive, skip_unknown=False)
+    summary = Summary() if args.summary else None
+    if len(args.output) > 0:
+        with open_csv(args.output) as f:
+            count = analyze(paths, f, args.jobs, args.chunksize, summary)
+    else:
+        count = analyze(paths, sys.stdout, args.jobs, args.chunksize, summary)
+    sys.stderr.write(str(count) + ' captures measured\n')
+    if summary is not None:
+        sys.stderr.write('\n'.join(summary.lines()) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
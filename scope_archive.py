@@ -0,0 +1,322 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compressed archives of many captures, for logging runs that save a capture every few
+# seconds for days.
+#
+#     with scope_archive.ArchiveWriter('run.rca') as archive:
+#         for frame in scp.stream('RAW'):
+#             archive.append(scp, frame)
+#
+#     archive = scope_archive.ArchiveReader('run.rca')
+#     scp = archive.load(len(archive) - 1)
+#
+# Successive captures of a repetitive signal differ little, so each channel's raw_points
+# are stored as the difference (modulo 256) from the previous capture and compressed with
+# zlib, one block per channel and capture.  Every keyframe_interval-th capture is stored
+# whole, so reading any capture decodes at most that many blocks.  Compression and writing
+# run on a background thread; append only copies the samples.
+#
+# Layout (little-endian):
+#     8 bytes   MAGIC
+#     uint32    format version
+#     uint32    reserved
+#     blocks    zlib compressed samples, one per active channel of each capture
+#     JSON      the index: every distinct set of settings once, and for each capture its
+#               date, settings, keyframe, blocks and the scope's measurements
+#     uint64    offset of the index, uint32 its length, 8 bytes MAGIC
+#
+# The index is written by close(), so an archive that wasn't closed can't be read.
+
+import sys
+import json
+import zlib
+import struct
+import argparse
+import threading
+import numpy as np
+import scope
+import scope_capture
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+MAGIC = b'RIGOLARC'
+VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_FOOTER = struct.Struct('<QI8s')
+
+KEYFRAME_INTERVAL = 16
+LEVEL = 3          # zlib compression level, 1 (fastest) to 9 (smallest)
+MAX_PENDING = 8    # captures waiting to be compressed before append blocks (or drops)
+
+_SETTINGS_FIELDS = ['id', 'waveform_pnts_mode', 'time_per_division', 'time_offset', 'num_channels']
+_CHANNEL_FIELDS = ['ch_num', 'volts_div', 'vert_offset', 'sample_rate']
+_MEASURE_FIELDS = ['vmax', 'vmin', 'vpp', 'vamp', 'vrms', 'freq', 'duty_cycle']
+
+
+class ArchiveWriter(object):
+    """ Writes captures to a compressed archive at path.  When the background thread falls
+        more than max_pending captures behind, append waits for it, or with drop=True skips
+        the capture and counts it in dropped.  Errors of the thread are raised by the next
+        append or close. """
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL, level=LEVEL, max_pending=MAX_PENDING,
+                 drop=False):
+        self._path = path
+        self._keyframe_interval = max(keyframe_interval, 1)
+        self._level = level
+        self._drop = drop
+        self._dropped = 0
+        self._count = 0
+        self._pending = queue.Queue(max(max_pending, 1))
+        self._error = None
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION, 0))
+        self._settings = []      # distinct settings in the order first seen
+        self._settings_ids = {}  # their JSON -> index in _settings
+        self._frames = []
+        self._previous = None    # raw_points of the last capture written, per channel
+        self._key = 0            # index of the last keyframe
+        self._thread = threading.Thread(target=self._run, name='ArchiveWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, scp, frame=None):
+        """ Queues a copy of the active channels of scp, or of frame, a Frame that scp
+            streamed.  Returns False if the capture was dropped. """
+        self._raise_error()
+        channels = scp.active_channels
+        if frame is None:
+            raw_points = [np.array(ch.raw_points, dtype=np.uint8) for ch in channels]
+            retrieval_date = scp.retrieval_date
+            # measurements not computed yet (CLIENT_MEASUREMENTS) are left to load()
+            measures = [None if ch._pending_measures else [getattr(ch, name) for name in _MEASURE_FIELDS]
+                        for ch in channels]
+        else:
+            raw_points = [np.array(frame.raw_points[ch.ch_num], dtype=np.uint8) for ch in channels]
+            retrieval_date = frame.retrieval_date
+            measures = None  # streamed frames aren't measured by the scope
+        settings = dict((name, getattr(scp, name)) for name in _SETTINGS_FIELDS)
+        settings['id'] = str(scp.id)
+        settings['channels'] = []
+        for ch, points in zip(channels, raw_points):
+            ch_settings = dict((name, getattr(ch, name)) for name in _CHANNEL_FIELDS)
+            ch_settings['num_points'] = len(points)
+            settings['channels'].append(ch_settings)
+        item = (settings, retrieval_date.isoformat(), raw_points, measures)
+        try:
+            self._pending.put(item, not self._drop)
+        except queue.Full:
+            self._dropped += 1
+            return False
+        self._count += 1
+        return True
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self._error = e
+
+    def _settings_id(self, settings):
+        key = json.dumps(settings, sort_keys=True)
+        if key not in self._settings_ids:
+            self._settings_ids[key] = len(self._settings)
+            self._settings.append(settings)
+        return self._settings_ids[key]
+
+    def _write(self, settings, retrieval_date, raw_points, measures):
+        index = len(self._frames)
+        layout = [len(points) for points in raw_points]
+        if (self._previous is None or [len(points) for points in self._previous] != layout or
+                index - self._key >= self._keyframe_interval):
+            self._key = index
+            blocks = raw_points
+        else:
+            blocks = [np.subtract(points, previous) for points, previous in zip(raw_points, self._previous)]
+        offsets = []
+        for block in blocks:
+            data = zlib.compress(memoryview(block), self._level)
+            offsets.append([self._file.tell(), len(data)])
+            self._file.write(data)
+        self._frames.append({'date': retrieval_date, 'settings': self._settings_id(settings), 'key': self._key,
+                             'blocks': offsets, 'measures': measures})
+        self._previous = raw_points
+
+    def close(self):
+        """ Waits for the queued captures and writes the index """
+        if self._file is None:
+            return
+        self._pending.put(None)
+        self._thread.join()
+        try:
+            self._raise_error()
+        finally:
+            index = json.dumps({'settings': self._settings, 'frames': self._frames}).encode('utf-8')
+            offset = self._file.tell()
+            self._file.write(index)
+            self._file.write(_FOOTER.pack(offset, len(index), MAGIC))
+            self._file.close()
+            self._file = None
+
+    # Captures appended, including those still being compressed
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def path(self):
+        return self._path
+
+
+class ArchiveReader(object):
+    """ Reads captures from an archive by index, in any order.  Reading them in order
+        decodes one block per channel each. """
+
+    def __init__(self, path):
+        self._path = path
+        with open(path, 'rb') as f:
+            magic, version, reserved = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(path + ' is not a capture archive')
+            if version > VERSION:
+                raise ValueError(path + ' is archive format version ' + str(version) +
+                                 ', newer than this program supports (' + str(VERSION) + ')')
+            f.seek(-_FOOTER.size, 2)
+            offset, length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(path + ' has no index, it was not closed')
+            f.seek(offset)
+            index = json.loads(f.read(length).decode('utf-8'))
+        self._settings = index['settings']
+        self._frames = index['frames']
+        self._decoded = None  # (index, raw_points) of the last capture decoded
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _read_blocks(self, f, frame):
+        blocks = []
+        for offset, length in frame['blocks']:
+            f.seek(offset)
+            blocks.append(np.frombuffer(zlib.decompress(f.read(length)), dtype=np.uint8))
+        return blocks
+
+    def raw_points(self, i):
+        """ The raw_points of each active channel of capture i, in channel order.  The arrays
+            are shared with the next capture decoded, copy them to keep them. """
+        if i < 0:
+            i += len(self._frames)
+        if not 0 <= i < len(self._frames):
+            raise IndexError('archive index out of range')
+        key = self._frames[i]['key']
+        if self._decoded is not None and key <= self._decoded[0] <= i:
+            start, raw_points = self._decoded
+        else:
+            start, raw_points = key, None
+        with open(self._path, 'rb') as f:
+            for index in range(start, i + 1):
+                if raw_points is not None and index == start:
+                    continue
+                blocks = self._read_blocks(f, self._frames[index])
+                if index == key:
+                    raw_points = [np.array(block) for block in blocks]
+                else:
+                    for points, delta in zip(raw_points, blocks):
+                        points += delta
+        self._decoded = (i, raw_points)
+        return raw_points
+
+    def settings(self, i):
+        return self._settings[self._frames[i]['settings']]
+
+    def retrieval_date(self, i):
+        return scope_capture._parse_date(self._frames[i]['date'])
+
+    def load(self, i):
+        """ Capture i as a DS1000.  Captures of streamed frames are measured with
+            scope_measure. """
+        settings = self.settings(i)
+        frame = self._frames[i]
+        scp = scope.DS1000(self._path, settings['num_channels'])
+        for n, (ch_settings, points) in enumerate(zip(settings['channels'], self.raw_points(i))):
+            ch = scp.get_channel(ch_settings['ch_num'])
+            if frame['measures'] is None:
+                ch._set_data(1, np.array(points), ch_settings['volts_div'], ch_settings['vert_offset'],
+                             ch_settings['sample_rate'])
+            else:
+                restored = dict(zip(_MEASURE_FIELDS, frame['measures'][n] or [None] * len(_MEASURE_FIELDS)))
+                restored.update(ch_settings)
+                restored['state'] = 1
+                ch._restore(restored, np.array(points))
+        scp._restore({'device_path': self._path, 'id': settings['id'], 'retrieval_date': self.retrieval_date(i),
+                      'waveform_pnts_mode': settings['waveform_pnts_mode'],
+                      'time_per_division': settings['time_per_division'], 'time_offset': settings['time_offset']})
+        return scp
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List or extract the captures in a capture archive')
+    parser.add_argument('archive', help='archive file')
+    parser.add_argument('-x', '--extract', help='index of a capture to save as a capture file', type=int,
+                        default=None)
+    parser.add_argument('-o', '--output', help='capture file to write with --extract', default='')
+    args = parser.parse_args()
+    if args.extract is not None and len(args.output) == 0:
+        parser.error('--extract needs --output')
+
+    archive = ArchiveReader(args.archive)
+    if args.extract is not None:
+        scope_capture.save(archive.load(args.extract), args.output)
+        return 0
+    for i in range(len(archive)):
+        settings = archive.settings(i)
+        channels = ', '.join('CH' + str(ch['ch_num']) + ' ' + scope.abbreviate_points(ch['num_points'])
+                             for ch in settings['channels'])
+        sys.stdout.write('%6d  %s  %s  %s\n' % (i, archive.retrieval_date(i), settings['waveform_pnts_mode'],
+                                                channels))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
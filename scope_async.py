@@ -0,0 +1,464 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# asyncio interface to the scope (Python 3.5 or later):
+#
+#     async with scope_async.AsyncDS1000('/dev/usbtmc0', 2) as scp:
+#         await scp.query_scope('RAW', timeout=10.0)
+#         print(scp.get_channel(1).vpp)
+#
+# Commands are paced with asyncio.sleep using the rigolusb pacing mode and table.  Device
+# files that can be polled (ttys such as scope_sim, FIFOs and sockets) are read and written
+# without blocking from the event loop.  The Linux usbtmc driver can't be polled for data,
+# so for it each read and write runs in the loop's default executor instead.
+#
+# Commands can be cancelled or time out at any point.  On a pollable file the answer to an
+# interrupted query is drained before the next command; in the executor the interrupted
+# command runs to completion first.  Don't use the same scope
+# from an AsyncSession and from rigolusb at the same time.
+
+import os
+import stat
+import asyncio
+import datetime
+from timeit import default_timer as timer
+import rigolusb
+import scope
+
+DRAIN_WAIT = 5.0     # seconds to wait for an interrupted response when the session has no timeout
+DRAIN_QUIET = 0.050  # seconds without data after which a pollable device counts as drained
+
+
+# One command and its response with blocking I/O, see AsyncSession._in_executor
+def _transfer(os_file, command, read_bytes, buffer, opc):
+    os.write(os_file, bytearray(command, 'ascii'))
+    if buffer is not None:
+        return rigolusb._read_block(os_file, buffer)
+    if read_bytes > 0:
+        return os.read(os_file, read_bytes)
+    if opc:
+        os.write(os_file, bytearray('*OPC?', 'ascii'))
+        os.read(os_file, 20)
+
+
+def _is_pollable(os_file):
+    mode = os.fstat(os_file).st_mode
+    return stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or os.isatty(os_file)
+
+
+class AsyncSession(object):
+    """ The asyncio counterpart of rigolusb.Session.  Commands are serialized by an
+        asyncio.Lock and each one is limited to timeout seconds (None waits forever). """
+
+    def __init__(self, device_path, timeout=5.0):
+        self._device_path = device_path
+        self._timeout = timeout
+        self._os_file = None
+        self._pollable = False
+        self._lock = None
+        self._gap = 0.0   # pacing needed after the last command
+        self._done = 0.0  # when the last command finished
+        self._pending = None  # executor call, still running if its command was cancelled
+        self._desynced = False
+        self._id = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        if self._os_file is None:
+            self._os_file = rigolusb.open_device_file(self._device_path)
+            self._pollable = _is_pollable(self._os_file)
+            if self._pollable:
+                os.set_blocking(self._os_file, False)
+            self._lock = asyncio.Lock()
+        return self
+
+    async def close(self, local=True):
+        if self._os_file is None:
+            return
+        try:
+            if local:
+                await self.set_local()
+        finally:
+            await self._finish_pending()
+            rigolusb.close_device_file(self._os_file)
+            self._os_file = None
+
+    # Forget cached settings, e.g. after the scope was power cycled
+    def invalidate(self):
+        self._id = None
+
+    @property
+    def device_path(self):
+        return self._device_path
+
+    @property
+    def os_file(self):
+        if self._os_file is None:
+            raise IOError('session for ' + self._device_path + ' is not open')
+        return self._os_file
+
+    @property
+    def is_open(self):
+        return self._os_file is not None
+
+    @property
+    def pollable(self):
+        return self._pollable
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    # Non-blocking I/O for pollable device files
+
+    async def _ready(self, add, remove):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        add(self._os_file, wake)
+        try:
+            await future
+        finally:
+            remove(self._os_file)
+
+    async def _write(self, data):
+        loop = asyncio.get_event_loop()
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                view = view[os.write(self._os_file, view):]
+            except BlockingIOError:
+                await self._ready(loop.add_writer, loop.remove_writer)
+
+    async def _read(self, read_bytes):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                return os.read(self._os_file, read_bytes)
+            except BlockingIOError:
+                await self._ready(loop.add_reader, loop.remove_reader)
+
+    async def _read_block(self, buffer):
+        loop = asyncio.get_event_loop()
+        reader = rigolusb._BlockReader(buffer)
+        view = reader.next_view()
+        while view is not None:
+            try:
+                count = rigolusb._readinto(self._os_file, view)
+            except BlockingIOError:
+                await self._ready(loop.add_reader, loop.remove_reader)
+                continue
+            if count == 0:
+                break
+            reader.advance(count)
+            view = reader.next_view()
+        return reader.result()
+
+    async def _transfer(self, command, read_bytes, buffer, opc):
+        await self._write(bytearray(command, 'ascii'))
+        if buffer is not None:
+            return await self._read_block(buffer)
+        if read_bytes > 0:
+            return await self._read(read_bytes)
+        if opc:
+            await self._write(bytearray('*OPC?', 'ascii'))
+            await self._read(20)
+
+    # Throw away the response to an interrupted query.  It may not have been sent yet, so
+    # wait up to the session timeout for it to start and then until the device goes quiet.
+    async def _drain(self):
+        loop = asyncio.get_event_loop()
+        wait = self._timeout if self._timeout is not None else DRAIN_WAIT
+        while True:
+            try:
+                if not os.read(self._os_file, rigolusb.MAX_POINTS):
+                    break
+                wait = DRAIN_QUIET
+            except BlockingIOError:
+                try:
+                    await asyncio.wait_for(self._ready(loop.add_reader, loop.remove_reader), wait)
+                except asyncio.TimeoutError:
+                    break
+        self._desynced = False
+
+    # Blocking I/O in the executor, for device files that can't be polled.  A whole
+    # command and its response go in one call, shielded from cancellation so the device is
+    # never left part way through a response; the next command waits for it to finish.
+
+    async def _in_executor(self, func, *args):
+        loop = asyncio.get_event_loop()
+        self._pending = loop.run_in_executor(None, func, *args)
+        result = await asyncio.shield(self._pending)
+        self._pending = None
+        return result
+
+    async def _finish_pending(self):
+        if self._pending is not None:
+            pending = self._pending
+            self._pending = None
+            await asyncio.wait([pending])
+            if not pending.cancelled():
+                pending.exception()  # an interrupted command's error is of no further interest
+
+    async def _pace(self):
+        if rigolusb.get_pacing() == rigolusb.FIXED:
+            await asyncio.sleep(rigolusb.FIXED_DELAY)
+            return
+        remaining = self._gap - (timer() - self._done)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    async def _exchange(self, command, read_bytes, buffer):
+        gap = rigolusb.FIXED_DELAY
+        opc = rigolusb.get_pacing() == rigolusb.OPC
+        expects_response = buffer is not None or read_bytes > 0 or opc
+        response_owed = False
+        try:
+            await self._finish_pending()
+            if self._desynced:
+                await self._drain()
+            await self._pace()
+            if self._pollable:
+                response_owed = expects_response
+                response = await self._transfer(command, read_bytes, buffer, opc)
+            else:
+                response = await self._in_executor(_transfer, self._os_file, command, read_bytes, buffer, opc)
+            gap = rigolusb.QUERY_PACING if expects_response else rigolusb._command_gap(command)
+            return response
+        except BaseException:
+            # cancelled, timed out or failed part way: the response may still be on its way
+            if response_owed:
+                self._desynced = True
+            raise
+        finally:
+            self._gap = gap
+            self._done = timer()
+
+    async def send_command(self, command, read_bytes=0, buffer=None):
+        """ Sends command and returns up to read_bytes of the response, or with a buffer from
+            rigolusb.new_points_buffer() the data block read into it """
+        async with self._lock:
+            self.os_file  # raises if the session isn't open
+            if self._timeout is None:
+                return await self._exchange(command, read_bytes, buffer)
+            return await asyncio.wait_for(self._exchange(command, read_bytes, buffer), self._timeout)
+
+    # The rigolusb commands
+
+    async def set_stop(self):
+        await self.send_command(":STOP")
+
+    async def set_run(self):
+        await self.send_command(":RUN")
+
+    async def set_single(self):
+        await self.send_command(":SING")
+
+    async def set_local(self):
+        await self.send_command(":KEY:FORC")
+
+    async def get_trigger_status(self):
+        return (await self.send_command(":TRIG:STAT?", 20)).decode('ascii').strip()
+
+    async def wait_for_stop(self, timeout=5.0, poll_interval=0.005):
+        deadline = timer() + timeout
+        while await self.get_trigger_status() != 'STOP':
+            if timer() > deadline:
+                raise IOError('timed out waiting for the scope to trigger')
+            await asyncio.sleep(poll_interval)
+
+    async def get_id(self):
+        if self._id is None:
+            self._id = str(await self.send_command("*IDN?", 2000))
+        return self._id
+
+    async def get_time_per_division(self):
+        return float(await self.send_command(":TIM:SCAL?", 20))
+
+    async def get_time_offset(self):
+        return float(await self.send_command(":TIM:OFFS?", 20))
+
+    async def get_channel_state(self, ch_num):
+        return int(await self.send_command(":CHAN" + str(ch_num) + ":DISP?", 20))
+
+    async def get_points(self, waveform_pnts_mode, ch_num, buffer=None):
+        await self.send_command(":WAV:POIN:MODE " + waveform_pnts_mode)
+        if buffer is not None:
+            return await self.send_command(":WAV:DATA? CHAN" + str(ch_num), buffer=buffer)
+        buffer = rigolusb.new_points_buffer()
+        points = await self.send_command(":WAV:DATA? CHAN" + str(ch_num), buffer=buffer)
+        if len(points) < len(buffer) // 2:
+            points = points.copy()
+        return points
+
+    async def get_volts_div(self, ch_num):
+        return float(await self.send_command(":CHAN" + str(ch_num) + ":SCAL?", 20))
+
+    async def get_vertical_offset(self, ch_num):
+        return float(await self.send_command(":CHAN" + str(ch_num) + ":OFFS?", 20))
+
+    async def get_sample_rate(self, ch_num):
+        return float(await self.send_command(":ACQ:SAMP? CHAN" + str(ch_num), 20))
+
+    async def get_settings_response(self, num_channels, ch_nums=()):
+        state = rigolusb._device_state(self._os_file)
+        if not state.chain_settings:
+            return None
+        ch_nums = list(ch_nums)
+        try:
+            queries = rigolusb._state_queries(num_channels) + rigolusb._channel_settings_queries(ch_nums)
+            response = await self.send_command(";".join(queries), 20 * len(queries))
+            states, active = rigolusb._split_states(response, num_channels, ch_nums)
+            if states is not None and active != ch_nums:
+                queries = rigolusb._channel_settings_queries(active)
+                response = b''
+                if len(queries) > 0:
+                    response = await self.send_command(";".join(queries), 20 * len(queries))
+                response = rigolusb._join_settings(states, queries, response)
+            if response is not None:
+                rigolusb.parse_settings(response, num_channels)
+        except (OSError, ValueError):  # usbtmc read timed out or an answer is garbled
+            states = response = None
+        if states is None or response is None:
+            state.chain_settings = False
+            return None
+        return response
+
+    async def get_measurements(self, ch_num):
+        state = rigolusb._device_state(self._os_file)
+        if state.chain_measurements:
+            try:
+                values = (await self.send_command(rigolusb._measurements_query(ch_num),
+                                                  40 * len(rigolusb.MEASUREMENTS))).split(b';')
+                if len(values) == len(rigolusb.MEASUREMENTS):
+                    return rigolusb._parse_measurements(values)
+            except (OSError, ValueError):  # usbtmc read timed out or the answer is garbled
+                pass
+            state.chain_measurements = False
+        values = []
+        for query in rigolusb._measurement_queries(ch_num):
+            values.append(await self.send_command(query, 20))
+        return rigolusb._parse_measurements(values)
+
+
+class AsyncDS1000(scope.DS1000):
+    """ A DS1000 whose captures are coroutines.  Fills in the same Channels as DS1000, so
+        everything else (volt_points, time_axis, scope_capture, ...) works unchanged. """
+
+    def __init__(self, device_path, num_channels, timeout=5.0):
+        scope.DS1000.__init__(self, device_path, num_channels)
+        self._timeout = timeout
+
+    def __enter__(self):
+        raise TypeError('use "async with" with an AsyncDS1000')
+
+    async def __aenter__(self):
+        await self.open_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close_session()
+
+    async def open_session(self):
+        if self._session is None:
+            self._session = await AsyncSession(self._device_path, self._timeout).open()
+        return self._session
+
+    async def close_session(self):
+        if self._session is not None:
+            session = self._session
+            self._session = None
+            await session.close()
+
+    async def query_scope(self, _waveform_pnts_mode='NOR', session=None, timeout=None):
+        """ Captures all channels, like DS1000.query_scope.  timeout limits the whole capture
+            in seconds; the session's timeout still applies to every command. """
+        if timeout is None:
+            await self._query_scope(_waveform_pnts_mode, session)
+        else:
+            await asyncio.wait_for(self._query_scope(_waveform_pnts_mode, session), timeout)
+
+    # DS1000._load_time_base, sharing its settings cache
+    async def _load_time_base_async(self, session):
+        settings = self._settings
+        if self._needs_settings_query():
+            settings = self._update_settings(await session.get_settings_response(self._num_channels,
+                                                                                 self._expected_channels()))
+        if settings is None:
+            self._time_per_division = await session.get_time_per_division()
+            self._time_offset = await session.get_time_offset()
+            return [None] * self._num_channels
+        self._time_per_division = settings.time_per_division
+        self._time_offset = settings.time_offset
+        return settings.channels
+
+    async def _query_scope(self, _waveform_pnts_mode, session):
+        self._waveform_pnts_mode = _waveform_pnts_mode
+        session = session or self._session
+        own_session = session is None
+        if own_session:
+            session = await AsyncSession(self._device_path, self._timeout).open()
+        try:
+            self._os_file = session.os_file
+            await session.set_stop()
+            self._retrieval_date = datetime.datetime.now()
+            self._id = await session.get_id()
+            channel_settings = await self._load_time_base_async(session)
+            self._active_channels = []
+            for ch, ch_settings in zip(self._channels, channel_settings):
+                await _load_channel_data(session, ch, self._waveform_pnts_mode, ch_settings,
+                                         self._measurement_source == scope.SCOPE_MEASUREMENTS)
+                if ch.state == 1:
+                    self._active_channels.append(ch)
+        finally:
+            if own_session:
+                await session.close()
+        self._update_time_base()
+        if self._history is not None:
+            self._history.append(self)
+
+
+async def _load_channel_data(session, ch, waveform_pnts_mode, settings, measure_on_scope):
+    ch_num = ch.ch_num
+    if settings is None:
+        state = await session.get_channel_state(ch_num)
+        settings = rigolusb.ChannelSettings(state, 0.0, 0.0, 0.0)
+        if state:
+            settings = rigolusb.ChannelSettings(state, await session.get_volts_div(ch_num),
+                                                await session.get_vertical_offset(ch_num),
+                                                await session.get_sample_rate(ch_num))
+    if settings.state:
+        raw_points = await session.get_points(waveform_pnts_mode, ch_num, ch._points_buffer())
+        measures = None
+        if measure_on_scope:
+            measures = await session.get_measurements(ch_num)
+        ch._set_data(settings.state, raw_points, settings.volts_div, settings.vert_offset,
+                     settings.sample_rate, measures)
+    else:
+        ch._set_data(settings.state)
@@ -0,0 +1,219 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmarks for the acquisition, conversion and measurement hot paths, run against scope_sim.
+#
+#     python scope_bench.py -o results.json              Note: writes results as JSON
+#     python scope_bench.py -b baseline.json             Note: compares against a saved run
+#     python scope_bench.py -b baseline.json -t 1.2      Note: exits 1 if anything is 20% slower
+#     python scope_bench.py -c commands.json             Note: also writes per command timings
+
+import sys
+import json
+import argparse
+import platform
+import datetime
+from timeit import default_timer as timer
+import numpy as np
+import rigolusb
+import scope
+import scope_sim
+import scope_measure
+import scope_events
+import scope_spectrum
+
+
+# (name, waveform points mode, long memory, channel 2 enabled) -> 600, 8K, 16K, 512K and 1M points
+CAPTURES = [
+    ('query_scope_NOR_600', 'NOR', False, True),
+    ('query_scope_RAW_8K', 'RAW', False, True),
+    ('query_scope_RAW_16K', 'RAW', False, False),
+    ('query_scope_RAW_512K', 'RAW', True, True),
+    ('query_scope_RAW_1M', 'RAW', True, False),
+]
+POINT_COUNTS = [('600', 600), ('8K', 8192), ('16K', 16384), ('512K', 524288), ('1M', 1048576)]
+
+
+def _time(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = timer()
+        func()
+        times.append(timer() - start)
+    return {'runs': repeat, 'min': min(times), 'median': float(np.median(times)),
+            'mean': float(np.mean(times)), 'max': max(times)}
+
+
+def bench_send_command(device_path, repeat):
+    results = {}
+    os_file = rigolusb.open_device_file(device_path)
+    try:
+        results['send_command_write'] = _time(lambda: rigolusb._send_command(os_file, ':STOP'), repeat)
+        results['send_command_query'] = _time(lambda: rigolusb._send_command(os_file, ':TIM:SCAL?', 20), repeat)
+    finally:
+        rigolusb.close_device_file(os_file)
+    return results
+
+
+def bench_query_scope(repeat, latency, captures=CAPTURES):
+    results = {}
+    for name, mode, long_memory, ch2_on in captures:
+        with scope_sim.SimulatedDS1052E(latency=latency, long_memory=long_memory) as sim:
+            sim.get_channel(2).state = int(ch2_on)
+            scp = scope.DS1000(sim.device_path, 2)
+            results[name] = _time(lambda: scp.query_scope(mode), repeat)
+    return results
+
+
+def bench_session(repeat, latency):
+    with scope_sim.SimulatedDS1052E(latency=latency) as sim:
+        with scope.DS1000(sim.device_path, 2) as scp:
+            return {'query_scope_session_NOR_600': _time(lambda: scp.query_scope('NOR'), repeat)}
+
+
+def bench_volt_conversion(repeat):
+    results = {}
+    ch = scope.Channel(1)
+    ch._volts_div = 0.5
+    ch._vert_offset = 0.1
+    for abbr, num_points in POINT_COUNTS:
+        ch._raw_points = np.random.RandomState(0).randint(0, 256, num_points).astype(np.uint8)
+        results['volt_conversion_' + abbr] = _time(ch._calc_volt_points, repeat)
+    return results
+
+
+def bench_measure(repeat):
+    results = {}
+    for abbr, num_points in POINT_COUNTS:
+        t = np.arange(num_points) / 1e6
+        volts = np.where((t * 1e4) % 1 < 0.3, 1.0, -1.0) + np.random.RandomState(0).normal(0, 0.02, num_points)
+        results['measure_' + abbr] = _time(lambda: scope_measure.measure(volts, 1e6), repeat)
+    return results
+
+
+def bench_events(repeat):
+    results = {}
+    for abbr, num_points in POINT_COUNTS:
+        t = np.arange(num_points) / 1e6
+        raw = np.where((t * 1e4) % 1 < 0.3, 100, 150) + np.random.RandomState(0).randint(0, 3, num_points)
+        records = scope_events.Records(raw.astype(np.uint8), 1.0, 0.0, 1e6)
+        results['events_edges_' + abbr] = _time(lambda: records.edges(0.0, 0.2), repeat)
+    return results
+
+
+def bench_spectrum(repeat):
+    results = {}
+    for abbr, num_points in POINT_COUNTS:
+        t = np.arange(num_points) / 1e6
+        volts = np.sin(2 * np.pi * 1e4 * t) + np.random.RandomState(0).normal(0, 0.02, num_points)
+        results['spectrum_' + abbr] = _time(lambda: scope_spectrum.spectrum(volts, 1e6), repeat)
+    return results
+
+
+def bench_time_axis(repeat):
+    results = {}
+    scp = scope.DS1000('', 2)
+    scp._time_per_division = 0.001
+    scp._samplerate_per_channel = 1e6
+    for abbr, num_points in POINT_COUNTS:
+        scp._points_per_channel = num_points
+        results['calc_time_axis_' + abbr] = _time(scp._calc_time_axis, repeat)
+    return results
+
+
+def run(repeat=5, latency=0.0, quick=False):
+    captures = [c for c in CAPTURES if not (quick and c[2])]
+    results = {}
+    with scope_sim.SimulatedDS1052E(latency=latency) as sim:
+        results.update(bench_send_command(sim.device_path, repeat * 10))
+    results.update(bench_query_scope(repeat, latency, captures))
+    results.update(bench_session(repeat, latency))
+    results.update(bench_volt_conversion(repeat * 10))
+    results.update(bench_measure(repeat))
+    results.update(bench_events(repeat))
+    results.update(bench_spectrum(repeat))
+    results.update(bench_time_axis(repeat * 10))
+    return {'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'latency': latency,
+            'results': results}
+
+
+def compare(current, baseline, threshold):
+    """ Returns (name, baseline median, current median, ratio) for every benchmark in both
+        runs and the names whose ratio exceeds threshold. """
+    rows = []
+    regressions = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = current['results'][name]['median']
+        ratio = new / old if old else float('inf')
+        rows.append((name, old, new, ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rigolusb and scope against a simulated DS1052E')
+    parser.add_argument('-r', '--repeat', help='captures per benchmark', type=int, default=5)
+    parser.add_argument('-l', '--latency', help='simulated per command latency in seconds', type=float, default=0.0)
+    parser.add_argument('-p', '--pacing', help='rigolusb command pacing', default=rigolusb.ADAPTIVE,
+                        choices=[rigolusb.FIXED, rigolusb.ADAPTIVE, rigolusb.OPC])
+    parser.add_argument('-q', '--quick', help='skip the 512K and 1M point captures', action='store_true')
+    parser.add_argument('-o', '--output', help='write results to a JSON file', default='')
+    parser.add_argument('-b', '--baseline', help='compare against results from a JSON file', default='')
+    parser.add_argument('-t', '--threshold', help='slowdown ratio counted as a regression', type=float, default=1.25)
+    parser.add_argument('-c', '--commands', help='write per command timing histograms to a JSON file', default='')
+    args = parser.parse_args()
+
+    rigolusb.set_pacing(args.pacing)
+    if len(args.commands) > 0:
+        rigolusb.enable_timing()
+    current = run(args.repeat, args.latency, args.quick)
+    if len(args.commands) > 0:
+        rigolusb.disable_timing()
+        with open(args.commands, 'w') as f:
+            rigolusb.timings.dump(f)
+    current['pacing'] = args.pacing
+    if len(args.output) > 0:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if len(args.baseline) > 0:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(current, baseline, args.threshold)
+        print('%-28s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio'))
+        for name, old, new, ratio in rows:
+            print('%-28s %12.6f %12.6f %8.2f%s' % (name, old, new, ratio, '  <--' if name in regressions else ''))
+        return 1 if regressions else 0
+
+    json.dump(current, sys.stdout, indent=2, sort_keys=True)
+    print('')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
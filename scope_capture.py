@@ -0,0 +1,225 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compact capture files for DS1000 data.
+#
+# Only the 1 byte/sample raw_points are stored, together with the settings needed to turn
+# them back into volts and a time axis, instead of pickling the float64 arrays.  Samples
+# are memory mapped on load so opening even a 1M point capture is near-instant.
+#
+# Layout (little-endian):
+#     8 bytes   MAGIC
+#     uint32    format version
+#     uint32    length of the JSON settings that follow
+#     JSON      scope settings, plus for each channel its settings and the file offset and
+#               length of its samples
+#     samples   uint8 raw_points of each active channel, 64 byte aligned
+
+import os
+import json
+import fnmatch
+import shelve
+import struct
+import datetime
+import numpy as np
+import scope
+try:
+    from dbm import whichdb
+except ImportError:  # Python 2
+    from whichdb import whichdb
+
+
+MAGIC = b'RIGOLCAP'
+VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_ALIGN = 64
+_DATE_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+_DBM_SUFFIXES = ['.dat', '.dir', '.bak', '.db', '.pag']  # files some dbm modules add to the name
+_replace = getattr(os, 'replace', os.rename)  # Python 2 has no os.replace
+
+_SCOPE_FIELDS = ['id', 'waveform_pnts_mode', 'time_per_division', 'time_offset']
+_CHANNEL_FIELDS = ['ch_num', 'state', 'volts_div', 'vert_offset', 'sample_rate']
+_MEASURE_FIELDS = ['vmax', 'vmin', 'vpp', 'vamp', 'vrms', 'freq', 'duty_cycle']
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _settings(scp, data_offsets):
+    settings = dict((name, getattr(scp, name)) for name in _SCOPE_FIELDS)
+    settings['id'] = str(scp.id)
+    settings['retrieval_date'] = scp.retrieval_date.isoformat()
+    settings['num_channels'] = scp.num_channels
+    settings['channels'] = []
+    for ch, offset in zip(scp.channels, data_offsets):
+        ch_settings = dict((name, getattr(ch, name)) for name in _CHANNEL_FIELDS)
+        # measurements not computed yet (CLIENT_MEASUREMENTS) are saved as null and computed
+        # from the samples when the capture is loaded and they are used
+        for name in _MEASURE_FIELDS:
+            ch_settings[name] = None if ch._pending_measures else getattr(ch, name)
+        ch_settings['data_offset'] = offset
+        ch_settings['num_points'] = ch.num_points if ch.state else 0
+        settings['channels'].append(ch_settings)
+    return settings
+
+
+# Save a queried DS1000 to path
+def save(scp, path):
+    # The header length depends on the offsets and the offsets on the header length, so
+    # lay it out once with placeholder offsets and pad the JSON to a fixed size.
+    placeholder = json.dumps(_settings(scp, [0] * scp.num_channels)).encode('utf-8')
+    header_len = _align(_HEADER.size + len(placeholder) + 32 * scp.num_channels)
+    offsets = []
+    offset = header_len
+    for ch in scp.channels:
+        offsets.append(offset)
+        if ch.state:
+            offset = _align(offset + ch.num_points)
+    meta = json.dumps(_settings(scp, offsets)).encode('utf-8')
+    meta += b' ' * (header_len - _HEADER.size - len(meta))
+    # Samples of a loaded capture are memory mapped from its file, so write next to it and
+    # swap the new file in only once done.  Saving a capture over itself would otherwise
+    # truncate the samples before they are read.
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(path)),
+                             '.' + os.path.basename(path) + '.' + str(os.getpid()) + '.tmp')
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(meta)))
+            f.write(meta)
+            for ch, offset in zip(scp.channels, offsets):
+                if ch.state:
+                    f.seek(offset)
+                    f.write(np.ascontiguousarray(ch.raw_points, dtype=np.uint8).tobytes())
+        _replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_history(history, directory):
+    """ Saves every capture in a scope.History to directory, named after its retrieval date
+        and index, and returns their paths """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = []
+    for frame in history:
+        name = frame.retrieval_date.strftime('%Y%m%d_%H%M%S_%f') + '_' + str(frame.index) + '.cap'
+        path = os.path.join(directory, name)
+        save(frame.to_scope(), path)
+        paths.append(path)
+    return paths
+
+
+# True if path is a capture file (as opposed to e.g. an older shelve file)
+def is_capture(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+# Files saved by scope_gui before the capture format are shelve databases.  Depending on
+# the dbm module one is a single file or several named after it, e.g. x.dat.dat, x.dat.dir
+# and x.dat.bak for x.dat.  Returns the name to open path with, or None if path isn't one.
+def shelve_path(path):
+    if whichdb(path):
+        return path
+    name, suffix = os.path.splitext(path)
+    if suffix in _DBM_SUFFIXES and whichdb(name):
+        return name
+    return None
+
+
+def find_captures(directories, pattern='*', recursive=False, skip_unknown=True):
+    """ Yields the paths of the capture files and older shelve files (see shelve_path) in
+        directories, sorted within each directory.  Other files are skipped, or also
+        yielded when skip_unknown is False, e.g. to report them. """
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            shelves = set()
+            for name in sorted(fnmatch.filter(files, pattern)):
+                path = os.path.join(root, name)
+                if is_capture(path):
+                    yield path
+                    continue
+                shelf = shelve_path(path)
+                if shelf is None:
+                    if not skip_unknown:
+                        yield path
+                elif shelf not in shelves:
+                    shelves.add(shelf)
+                    yield shelf
+            if not recursive:
+                break
+
+
+def read_settings(path):
+    """ Returns the settings stored in a capture file without touching the samples """
+    with open(path, 'rb') as f:
+        magic, version, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(path + ' is not a capture file')
+        if version > VERSION:
+            raise ValueError(path + ' is capture format version ' + str(version) +
+                             ', newer than this program supports (' + str(VERSION) + ')')
+        return json.loads(f.read(meta_len).decode('utf-8'))
+
+
+def _parse_date(text):
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    raise ValueError('bad retrieval date: ' + text)
+
+
+# Load a capture file as a DS1000.  Samples stay memory mapped (read-only) and volts are
+# only computed when used.
+def load(path):
+    settings = read_settings(path)
+    settings['retrieval_date'] = _parse_date(settings['retrieval_date'])
+    settings['device_path'] = path
+    scp = scope.DS1000(path, settings['num_channels'])
+    for ch_settings in settings['channels']:
+        raw_points = np.asarray([])
+        if ch_settings['state'] and ch_settings['num_points'] > 0:
+            raw_points = np.memmap(path, dtype=np.uint8, mode='r', offset=ch_settings['data_offset'],
+                                   shape=(ch_settings['num_points'],))
+        scp.get_channel(ch_settings['ch_num'])._restore(ch_settings, raw_points)
+    scp._restore(settings)
+    return scp
+
+
+# Load a capture file, or a shelve file saved before the capture format, as a DS1000
+def open_scope(path):
+    if is_capture(path):
+        return load(path)
+    if shelve_path(path) is None:
+        raise ValueError(path + ' is not a capture file')
+    db = shelve.open(shelve_path(path), 'r')
+    try:
+        return db['scope']
+    finally:
+        db.close()
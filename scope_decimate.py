@@ -0,0 +1,137 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Min/max decimation of waveform data for plotting.  Every bin of samples is reduced to its
+# minimum and maximum, in the order they occur, so peaks and glitches stay visible however
+# far the data is reduced.
+
+import numpy as np
+
+
+def _minmax_indices(y, num_bins):
+    bin_size = int(np.ceil(len(y) / float(num_bins)))
+    num_full = len(y) // bin_size
+    bins = y[:num_full * bin_size].reshape(num_full, bin_size)
+    offsets = np.arange(num_full) * bin_size
+    i_min = bins.argmin(axis=1) + offsets
+    i_max = bins.argmax(axis=1) + offsets
+    if num_full * bin_size < len(y):
+        tail = y[num_full * bin_size:]
+        start = num_full * bin_size
+        i_min = np.append(i_min, tail.argmin() + start)
+        i_max = np.append(i_max, tail.argmax() + start)
+    return np.column_stack((np.minimum(i_min, i_max), np.maximum(i_min, i_max))).ravel()
+
+
+# Reduce x and y to at most 2 * num_bins points.  Data that is already small enough is
+# returned as is, which may be a view of the arrays passed in.
+def minmax(x, y, num_bins):
+    num_bins = max(int(num_bins), 1)
+    if len(y) <= 2 * num_bins:
+        return x, y
+    indices = _minmax_indices(np.asarray(y), num_bins)
+    return np.asarray(x)[indices], np.asarray(y)[indices]
+
+
+class Pyramid(object):
+    """ Precomputed min/max levels over one waveform for fast decimation of any range.
+
+        Level k holds, for every bin of factor**(k+1) samples, the indices of its minimum and
+        maximum sample.  indices() picks the coarsest level that still gives num_bins bins over
+        the requested range and reduces it the rest of the way, so a view of a 1M point record
+        costs about as much as one of a few thousand points.  Build it from raw_points rather
+        than volts to save time and memory: the conversion is linear, so the extremes are the
+        same samples. """
+
+    def __init__(self, y, factor=4, min_bins=256):
+        self._y = np.asarray(y)
+        self._factor = factor
+        self._levels = []  # (bin size, (n, 2) array of min/max indices)
+        bin_size = factor
+        pairs = None
+        while len(self._y) // bin_size >= min_bins:
+            if pairs is None:
+                pairs = self._first_level(bin_size)
+            else:
+                pairs = self._next_level(pairs)
+            self._levels.append((bin_size, pairs))
+            bin_size *= factor
+
+    def _first_level(self, bin_size):
+        num_bins = len(self._y) // bin_size
+        bins = self._y[:num_bins * bin_size].reshape(num_bins, bin_size)
+        offsets = np.arange(num_bins) * bin_size
+        return np.column_stack((bins.argmin(axis=1) + offsets, bins.argmax(axis=1) + offsets))
+
+    def _next_level(self, pairs):
+        num_bins = len(pairs) // self._factor
+        return self._reduce(pairs[:num_bins * self._factor], self._factor)
+
+    def _reduce(self, pairs, group):
+        # combine every group consecutive bins into one, padding with the last bin
+        pad = (-len(pairs)) % group
+        if pad:
+            pairs = np.concatenate((pairs, np.repeat(pairs[-1:], pad, axis=0)))
+        i_min = pairs[:, 0].reshape(-1, group)
+        i_max = pairs[:, 1].reshape(-1, group)
+        rows = np.arange(len(i_min))
+        return np.column_stack((i_min[rows, self._y[i_min].argmin(axis=1)],
+                                i_max[rows, self._y[i_max].argmax(axis=1)]))
+
+    @property
+    def levels(self):
+        return len(self._levels)
+
+    @property
+    def nbytes(self):
+        return sum(pairs.nbytes for bin_size, pairs in self._levels)
+
+    def indices(self, lo, hi, num_bins):
+        """ Sorted sample indices covering [lo, hi), at most about 2 * num_bins of them """
+        lo = max(int(lo), 0)
+        hi = min(int(hi), len(self._y))
+        num_bins = max(int(num_bins), 1)
+        if hi - lo <= 2 * num_bins:
+            return np.arange(lo, hi)
+        target = (hi - lo) / float(num_bins)
+        level = None
+        for bin_size, pairs in self._levels:
+            if bin_size > target:
+                break
+            level = (bin_size, pairs)
+        if level is None:
+            return lo + _minmax_indices(self._y[lo:hi], num_bins)
+        bin_size, pairs = level
+        pairs = pairs[lo // bin_size:min(-(-hi // bin_size), len(pairs))]
+        tail = len(pairs) * bin_size
+        group = int(np.ceil(len(pairs) / float(num_bins)))
+        if group > 1:
+            pairs = self._reduce(pairs, group)
+        indices = np.sort(pairs, axis=1).ravel()
+        if hi > (lo // bin_size) * bin_size + tail:
+            # samples past the last complete bin of the level
+            start = (lo // bin_size) * bin_size + tail
+            indices = np.concatenate((indices, start + _minmax_indices(self._y[start:hi], 1)))
+        return indices
+
+    def decimate(self, x, y, lo, hi, num_bins):
+        """ x and y values for the samples chosen by indices() """
+        indices = self.indices(lo, hi, num_bins)
+        return np.asarray(x)[indices], np.asarray(y)[indices]
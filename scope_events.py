@@ -0,0 +1,199 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Software triggers over whole records: every edge, pulse, runt or window exit in a capture,
+# not just the one the scope triggered on.  Works on the 8-bit raw_points directly, with the
+# trigger levels in volts converted to sample levels, and on many records at once:
+#
+#     records = scope_events.from_channel(scp.get_channel(1), scp.time_axis[scope.SAMPLES])
+#     edges = records.edges(1.5, hysteresis=0.1)
+#     glitches = records.pulses(1.5, max_width=50e-9)
+#     print(len(edges.indices), glitches.times, glitches.widths)
+#
+# Records.edges, pulses, runts and windows return the record (row), sample index and time of
+# every event; indices are of the first sample past the trigger level.  Levels have
+# hysteresis like the scope's trigger sensitivity, so noise doesn't add events.
+
+import numpy as np
+from collections import namedtuple
+
+Events = namedtuple('Events', ['rows', 'indices', 'times'])
+Pulses = namedtuple('Pulses', ['rows', 'indices', 'times', 'widths'])  # widths in seconds
+
+RISING = 'rising'
+FALLING = 'falling'
+EITHER = 'either'
+POSITIVE = 'positive'
+NEGATIVE = 'negative'
+
+
+# True at the first sample of every run of True in each row
+def _run_starts(beyond):
+    starts = np.empty_like(beyond)
+    starts[:, 0] = beyond[:, 0]
+    np.greater(beyond[:, 1:], beyond[:, :-1], out=starts[:, 1:])
+    return starts
+
+
+class Records(object):
+    """ Records of 8-bit samples of equal length, one per row, to search for events.
+        volts_div, vert_offset and sample_rate are one value or one per record.  Times are in
+        the units of time_axis (e.g. DS1000.time_axis[SAMPLES]), or seconds from the first
+        sample without one.
+
+        Samples are searched as levels (255 - raw, see Channel._calc_volt_points) so that
+        higher levels are higher voltages, and the trigger levels are rounded to whole
+        levels, which gives the same result as comparing volts. """
+
+    def __init__(self, raw_points, volts_div, vert_offset, sample_rate, time_axis=None):
+        raw = np.atleast_2d(np.asarray(raw_points, dtype=np.uint8))
+        num_rows = raw.shape[0]
+        self._levels = np.invert(raw)
+        self._volts_div = np.broadcast_to(np.asarray(volts_div, dtype=np.float64), (num_rows,))
+        self._vert_offset = np.broadcast_to(np.asarray(vert_offset, dtype=np.float64), (num_rows,))
+        self._sample_rate = np.broadcast_to(np.asarray(sample_rate, dtype=np.float64), (num_rows,))
+        self._time_axis = None if time_axis is None else np.asarray(time_axis)
+
+    # Sample level of volts for every row, as a float
+    def _level(self, volts):
+        return (volts + 5.2 * self._volts_div + self._vert_offset) / (0.04 * self._volts_div)
+
+    # Whole levels to compare samples with: a sample is above volts when > _above(volts)
+    # and below volts when < _below(volts)
+    def _above(self, volts):
+        return np.clip(np.floor(self._level(volts)), -1, 255).astype(np.int16)
+
+    def _below(self, volts):
+        return np.clip(np.ceil(self._level(volts)), 0, 256).astype(np.int16)
+
+    # Flat sample indices (row * num_points + index) and directions (True going high) of
+    # every change of a Schmitt trigger at volts.  Only the first samples of runs above or
+    # below the hysteresis band can change its state, and there are few of them, so the state
+    # itself is never computed per sample.
+    def _flat_changes(self, volts, hysteresis):
+        above = _run_starts(self._levels > self._above(volts + hysteresis / 2.0)[:, None])
+        below = _run_starts(self._levels < self._below(volts - hysteresis / 2.0)[:, None])
+        flat = np.flatnonzero(above | below)
+        rising = above.ravel()[flat]
+        rows = flat // self._levels.shape[1]
+        # the state changes where a run starts on the other side from the previous one
+        changes = np.nonzero((rows[1:] == rows[:-1]) & (rising[1:] != rising[:-1]))[0] + 1
+        return flat[changes], rising[changes]
+
+    # Rows, indices and directions of the changes
+    def _changes(self, volts, hysteresis):
+        flat, rising = self._flat_changes(volts, hysteresis)
+        rows, cols = np.divmod(flat, self._levels.shape[1])
+        return rows, cols, rising
+
+    def _times(self, rows, indices):
+        if self._time_axis is not None:
+            return self._time_axis[indices]
+        return indices / self._sample_rate[rows]
+
+    # Pulses between consecutive changes, starting with rising ones when positive
+    def _pulses(self, volts, hysteresis, polarity):
+        rows, cols, rising = self._changes(volts, hysteresis)
+        starts = rows[:-1] == rows[1:]
+        starts &= rising[:-1] if polarity == POSITIVE else ~rising[:-1]
+        start = np.nonzero(starts)[0]
+        return rows[start], cols[start], cols[start + 1]
+
+    def edges(self, level, hysteresis=0.0, slope=RISING):
+        """ Where the signal crosses level (in volts) with slope RISING, FALLING or EITHER """
+        if slope not in (RISING, FALLING, EITHER):
+            raise ValueError('unknown slope: ' + str(slope))
+        rows, indices, rising = self._changes(level, hysteresis)
+        if slope != EITHER:
+            keep = rising if slope == RISING else ~rising
+            rows = rows[keep]
+            indices = indices[keep]
+        return Events(rows, indices, self._times(rows, indices))
+
+    def pulses(self, level, hysteresis=0.0, polarity=POSITIVE, min_width=None, max_width=None):
+        """ POSITIVE (above level) or NEGATIVE pulses, of at least min_width and at most
+            max_width seconds when given, e.g. glitches with max_width """
+        if polarity not in (POSITIVE, NEGATIVE):
+            raise ValueError('unknown polarity: ' + str(polarity))
+        rows, start, stop = self._pulses(level, hysteresis, polarity)
+        widths = (stop - start) / self._sample_rate[rows]
+        keep = np.ones(len(rows), dtype=bool)
+        if min_width is not None:
+            keep &= widths >= min_width
+        if max_width is not None:
+            keep &= widths <= max_width
+        rows = rows[keep]
+        start = start[keep]
+        return Pulses(rows, start, self._times(rows, start), widths[keep])
+
+    def runts(self, low, high, hysteresis=0.0, polarity=POSITIVE):
+        """ POSITIVE pulses that cross low but fall back without reaching high, or NEGATIVE
+            ones that cross high but come back without reaching low """
+        if polarity == POSITIVE:
+            level, extreme, reached = low, np.maximum, self._above(high)
+        elif polarity == NEGATIVE:
+            level, extreme, reached = high, np.minimum, self._below(low)
+        else:
+            raise ValueError('unknown polarity: ' + str(polarity))
+        rows, start, stop = self._pulses(level, hysteresis, polarity)
+        # extreme of each pulse from one pass over the flattened records
+        num_points = self._levels.shape[1]
+        bounds = np.empty(2 * len(rows), dtype=np.intp)
+        bounds[0::2] = rows * num_points + start
+        bounds[1::2] = rows * num_points + stop
+        if len(rows) == 0:
+            return Pulses(rows, start, self._times(rows, start), np.empty(0))
+        peaks = extreme.reduceat(self._levels.ravel(), bounds)[0::2]
+        if polarity == POSITIVE:
+            keep = peaks <= reached[rows]
+        else:
+            keep = peaks >= reached[rows]
+        rows = rows[keep]
+        start = start[keep]
+        widths = (stop[keep] - start) / self._sample_rate[rows]
+        return Pulses(rows, start, self._times(rows, start), widths)
+
+    def windows(self, low, high, hysteresis=0.0):
+        """ Where the signal goes above high or below low, coming from the window between
+            them or (between two samples) straight from the other side """
+        high_flat, high_rising = self._flat_changes(high, hysteresis)
+        low_flat, low_rising = self._flat_changes(low, hysteresis)
+        exits = np.union1d(high_flat[high_rising], low_flat[~low_rising])
+        rows, indices = np.divmod(exits, self._levels.shape[1])
+        return Events(rows, indices, self._times(rows, indices))
+
+    @property
+    def num_records(self):
+        return self._levels.shape[0]
+
+    @property
+    def num_points(self):
+        return self._levels.shape[1]
+
+
+def from_channel(ch, time_axis=None):
+    return Records(ch.raw_points, ch.volts_div, ch.vert_offset, ch.sample_rate, time_axis)
+
+
+def from_channels(channels, time_axis=None):
+    """ Records of channels with the same number of points, e.g. the same channel of many
+        captures, one row each in order """
+    return Records(np.stack([ch.raw_points for ch in channels]), [ch.volts_div for ch in channels],
+                   [ch.vert_offset for ch in channels], [ch.sample_rate for ch in channels], time_axis)
@@ -19,174 +19,240 @@
 # SOFTWARE.
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
 import argparse
-from matplotlib import gridspec
 import scope
-import shelve
-from threading import Timer
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-d', '--device', help='device path.  ex. "/dev/usbtmc1", default is /dev/usbtmc1', required=False,
-                    default='/dev/usbtmc1')
-
-parser.add_argument('-p', '--printfriendly', help='Uses white background and black lines and text',
-                    action="store_true")
-
-parser.add_argument('-m', '--mode', help='Wave Point Mode setting', required=False, default='RAW',
-                    choices=['NOR', 'RAW'])  # NOR limits to 600 points and shows measurements
-
-parser.add_argument('-s', '--style', help='Graph data using dots or lines', required=False, default='lines',
-                    choices=['lines', 'dots'])
-
-parser.add_argument('-i', '--input', help='Import data from file', required=False, default='')
-
-parser.add_argument('-o', '--output', help='Save data to file', required=False, default='')
-
-args = parser.parse_args()
-device_path = args.device
-printer_friendly = args.printfriendly
-waveform_pnts_mode = args.mode
-graph_style = args.style
-input_file = args.input
-output_file = args.output
-
-
-# Adjust chunksize for large number of data points.
-mpl.rcParams['agg.path.chunksize'] = 20000
-
-scp = None
-if len(input_file) > 0:
-    # Import scope data from file
-    db = shelve.open(input_file)
-    scp = db['scope']
-    db.close()
-else:
-    # Create scope object and retrieve data
-    scp = scope.DS1000(device_path, 2)
-    scp.query_scope(waveform_pnts_mode)
-if len(output_file) > 0:
-    # Export scope data to file
-    db = shelve.open(output_file)
-    db['scope'] = scp
-    db.close()
-
-# Create figure and use date and time as title which doubles as default filename when saving image.
-fig = plt.figure(scp.retrieval_date.strftime("%Y%m%d_%H%M%S") + "_scope_output")
-fig.suptitle(scp.retrieval_date.strftime("     %x   %X"), weight='bold')
-
-
-# Depicts waveform window in memory similar to top center graphic on Rigol scope.
-def draw_mem_map(ax, ch_ax):
-    ax.set_title("Waveform Window in Memory")
-    ax.tick_params(axis='both', which='both', bottom='off', top='off',
-                   left='off', right='off', labelleft='off', labelbottom='off')
-    ax.set_xlim(scp.time_axis[scope.SAMPLES][0], scp.time_axis[scope.SAMPLES][len(scp.time_axis[scope.SAMPLES])-1])
-    ax.plot(np.asarray([scp.time_axis[scope.SAMPLES][0],
-            scp.time_axis[scope.SAMPLES][len(scp.time_axis[scope.SAMPLES])-1]]),
-            np.asarray([1, 1]), lw=1, color='black')
-    ax.set_navigate(False)
-    return ax.plot(np.asarray(ch_ax.get_xlim()), np.asarray([1, 1]), lw=3, marker='s', color='black')
-
-
-# Graphs channel data
-def draw_ch(ch, ch_ax, num, x_min, x_max, ax_color, fig_bg_color, grid_color):
-    ch_ax.margins(y=0.2)
-    ch_ax.set_title("Channel " + str(num))
-    ch_ax.set_xlabel("Time " + scp.time_axis[scope.UNITS])
-    ch_ax.set_ylabel("Voltage (V)")
-    if ch.state and ch.num_points == 600:
-        ch_ax.text(0.01, 0.01, ch.meas_string, ha="left", va="bottom", size='small',
-                   transform=ch_ax.transAxes, color=ax_color)
-    ch_ax.set_facecolor(fig_bg_color)
-    if graph_style == 'lines':
-        ch_ax.plot(scp.time_axis[scope.SAMPLES], ch.volt_points, color=ax_color)
-    elif graph_style == 'dots':
-        ch_ax.plot(scp.time_axis[scope.SAMPLES], ch.volt_points, linestyle='', marker='.', color=ax_color)
-    ch_ax.grid(color=grid_color)
-    ch_ax.set_xlim(scp.time_axis[scope.SAMPLES][x_min], scp.time_axis[scope.SAMPLES][x_max])
-    ch_ax.text(0.99, 0.98, ch.num_points_abbr + " Points", ha="right", va="top", size='small',
-               transform=ch_ax.transAxes, color=ax_color)
-
-
-# Updates Waveform Memory Map
-def redraw_mem_map():
-    if scp.num_active_channels > 0:
-        map_x_raw = mem_ax_lines[0].get_xdata()
-        ch_x_raw = ch_ax_ref.get_xlim()
-        map_x_rnd = (round(map_x_raw[0], 6), round(map_x_raw[1], 6))
-        ch_x_rnd = (round(ch_x_raw[0], 6), round(ch_x_raw[1], 6))
-        if map_x_rnd != ch_x_rnd:
-            mem_ax_lines[0].set_xdata(np.asarray(ch_ax_ref.get_xlim()))
-            gs.tight_layout(fig, rect=[0.01, 0, 1, 0.95])
-            plt.draw()
-
-
-# hack: lets channels repaint before redrawing mem map
-def mem_map_timer(event):
-    Timer(0, redraw_mem_map).start()
-fig.canvas.mpl_connect('draw_event', mem_map_timer)
-
-
-# Maximizes plots in figure canvas.
-def on_resize(event):
-    gs.tight_layout(fig, rect=[0.01, 0, 1, 0.95])
-    fig.canvas.draw_idle()
-fig.canvas.mpl_connect('resize_event', on_resize)
-
-
-# Set colors based on whether we intend to print or just view on monitor
-fig_bg_color = 'black'
-grid_color = 'white'
-plot_colors = ['yellow', 'cyan', 'deeppink', 'lightblue']
-# added two extra colors (deeppink and lightblue) in hopes of supporting 4ch scope in the future.
-if printer_friendly:
-    fig_bg_color = 'white'
-    grid_color = 'black'
-    plot_colors = ['black', 'black', 'black', 'black']
-
-
-# Calculate min and max initial display points so that amount of data displayed matches scope.
-if scp.points_per_channel == 600:  # zoom out to all points
-    x_min = 0
-    x_max = 599
-else:
-    x_mid = round(len(scp.time_axis[scope.SAMPLES])/2)
-    total_points_displayed = (scp.time_per_division * 12) * scp.samplerate_per_channel
-    x_min = int(x_mid - round(total_points_displayed/2))
-    x_max = int(x_mid + round(total_points_displayed/2))
-    if x_min < 0:
-        x_min = 0
-    if x_max > (len(scp.time_axis[scope.SAMPLES])-1):
-        x_max = int(len(scp.time_axis[scope.SAMPLES])-1)
-
-
-# Time to start ploting channel data
-if scp.num_active_channels > 0:
-    h_ratios = []
-    map_ratio = round((scp.num_active_channels * 20) / 12.0)
-    h_ratios.append(map_ratio)
-    for x in range(scp.num_active_channels):
-        h_ratios.append(20)
-
-    gs = gridspec.GridSpec(scp.num_active_channels + 1, 1, height_ratios=h_ratios)
-    num = 1
+import scope_capture
+import scope_decimate
+import sys
+import threading
+from timeit import default_timer as timer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--device', help='device path.  ex. "/dev/usbtmc1", default is /dev/usbtmc1',
+                        required=False, default='/dev/usbtmc1')
+
+    parser.add_argument('-c', '--channels', help='number of channels the scope has, default is 2',
+                        type=int, default=2)
+
+    parser.add_argument('-p', '--printfriendly', help='Uses white background and black lines and text',
+                        action="store_true")
+
+    parser.add_argument('-m', '--mode', help='Wave Point Mode setting', required=False, default='RAW',
+                        choices=['NOR', 'RAW'])  # NOR limits to 600 points and shows the scope's measurements
+
+    parser.add_argument('-s', '--style', help='Graph data using dots or lines', required=False, default='lines',
+                        choices=['lines', 'dots'])
+
+    parser.add_argument('-i', '--input', help='Import data from file', required=False, default='')
+
+    parser.add_argument('-o', '--output', help='Save data to file', required=False, default='')
+
+    parser.add_argument('-l', '--live', help='Keep acquiring and update the plot continuously', action="store_true")
+
+    parser.add_argument('-S', '--spectrum', help='Add a panel with the spectrum of each channel',
+                        action="store_true")
+
+    parser.add_argument('-n', '--no-plot', help="Don't plot, e.g. to only capture and save with -o",
+                        action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.live and len(args.input) > 0:
+        parser.error('--live reads from the scope and cannot be combined with --input')
+    if args.live and args.no_plot:
+        parser.error('--live plots what it reads and cannot be combined with --no-plot')
+    if args.channels < 1:
+        parser.error('--channels must be at least 1')
+    return args
+
+
+# Matplotlib is only imported when plotting, so capturing with --no-plot starts quickly
+def import_pyplot():
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    # Adjust chunksize for large number of data points.
+    mpl.rcParams['agg.path.chunksize'] = 20000
+    return plt
+
+
+# Live mode: a background thread streams frames from the scope and min/max decimates the
+# visible part to the plot's pixel width, and the figure only redraws the lines (blitting).
+def run_live(args):
+    from matplotlib import animation
+    from matplotlib import gridspec
+    import scope_render
+
+    plt = import_pyplot()
+    colors = scope_render.PRINT_COLORS if args.printfriendly else scope_render.SCREEN_COLORS
+    fig_bg_color = colors['background']
+    grid_color = colors['grid']
+    calc_display_range = scope_render.calc_display_range
+
+    scp = scope.DS1000(args.device, args.channels)
+    lock = threading.Lock()
+    first_frame = threading.Event()
+    stop = threading.Event()
+    latest = {'data': None, 'frames': 0, 'error': None}
+    view = {'xlim': None, 'width': 1000}
+
+    def acquire():
+        frames = scp.stream(args.mode, rearm=scope.RUN, drop=True)
+        try:
+            for frame in frames:
+                t = frame.time_axis[scope.SAMPLES]
+                if view['xlim'] is None:
+                    lo, hi = calc_display_range(scp)
+                    hi += 1
+                else:
+                    lo, hi = np.searchsorted(t, view['xlim'])
+                    lo = max(lo - 1, 0)
+                    hi = min(hi + 1, len(t))
+                data = {}
+                for ch in scp.active_channels:
+                    x, y = scope_decimate.minmax(t[lo:hi], frame.get_volts(ch.ch_num)[lo:hi], view['width'])
+                    data[ch.ch_num] = (np.array(x), np.array(y))  # frame buffers get reused
+                with lock:
+                    latest['data'] = data
+                    latest['frames'] += 1
+                first_frame.set()
+                if stop.is_set():
+                    break
+        except Exception as e:
+            with lock:
+                latest['error'] = e
+            first_frame.set()
+        finally:
+            frames.close()
+
+    thread = threading.Thread(target=acquire, name='scope_gui.live')
+    thread.daemon = True
+    thread.start()
+    first_frame.wait()
+    if latest['error'] is not None:
+        raise latest['error']
+
+    fig = plt.figure("live_scope_output")
+    fig.suptitle("Live", weight='bold')
+    if scp.num_active_channels == 0:
+        stop.set()
+        plt.figtext(0.45, 0.5, ' All Channels Off', color='black', weight='roman', size='small')
+        plt.show()
+        return
+
+    t = scp.time_axis[scope.SAMPLES]
+    x_min, x_max = calc_display_range(scp)
+    gs = gridspec.GridSpec(scp.num_active_channels, 1)
+    lines = []
     ch_ax_ref = None
-    for ch in scp.active_channels:
-        if num == 1:
-            ch_ax = fig.add_subplot(gs[num])
-            ch_ax_ref = ch_ax
-            mem_ax_lines = draw_mem_map(fig.add_subplot(gs[0]), ch_ax_ref)
+    for num, ch in enumerate(scp.active_channels):
+        ch_ax = fig.add_subplot(gs[num], sharex=ch_ax_ref)
+        ch_ax_ref = ch_ax_ref or ch_ax
+        ax_color = scope_render.plot_color(colors, ch.ch_num)
+        ch_ax.set_title("Channel " + str(ch.ch_num))
+        ch_ax.set_xlabel("Time " + scp.time_axis[scope.UNITS])
+        ch_ax.set_ylabel("Voltage (V)")
+        ch_ax.set_facecolor(fig_bg_color)
+        ch_ax.grid(color=grid_color)
+        ch_ax.set_xlim(t[x_min], t[x_max])
+        # full range of the 8-bit samples, see Channel._calc_volt_points
+        ch_ax.set_ylim(-5.2 * ch.volts_div - ch.vert_offset, 5 * ch.volts_div - ch.vert_offset)
+        if args.style == 'dots':
+            line, = ch_ax.plot([], [], linestyle='', marker='.', color=ax_color, animated=True)
         else:
-            ch_ax = fig.add_subplot(gs[num], sharex=ch_ax_ref)
-        draw_ch(ch, ch_ax, ch.ch_num, x_min, x_max, plot_colors[ch.ch_num - 1], fig_bg_color, grid_color)
-        num += 1
-else:
-    gs = gridspec.GridSpec(1, 1)
-    fig.add_subplot(gs[0])
-    plt.figtext(0.45, 0.5, ' Both Channels Off', color='black', weight='roman', size='small')
-
+            line, = ch_ax.plot([], [], color=ax_color, animated=True)
+        lines.append((ch.ch_num, line))
+        ch_ax.text(0.99, 0.98, scope.abbreviate_points(len(t)) + " Points", ha="right", va="top", size='small',
+                   transform=ch_ax.transAxes, color=ax_color)
+    fps_text = ch_ax_ref.text(0.01, 0.98, '', ha="left", va="top", size='small',
+                              transform=ch_ax_ref.transAxes, color=grid_color, animated=True)
+    gs.tight_layout(fig, rect=[0.01, 0, 1, 0.95])
 
-plt.show()
+    def on_view_change(event=None):
+        view['xlim'] = ch_ax_ref.get_xlim()
+        view['width'] = max(int(ch_ax_ref.get_window_extent().width), 1)
+    on_view_change()
+    ch_ax_ref.callbacks.connect('xlim_changed', on_view_change)
+    fig.canvas.mpl_connect('resize_event', on_view_change)
+    fig.canvas.mpl_connect('close_event', lambda event: stop.set())
+
+    rate = {'time': timer(), 'frames': 0}
+
+    def update(i):
+        with lock:
+            data = latest['data']
+            frames = latest['frames']
+            error = latest['error']
+        if error is not None:
+            # acquisition failed after the first frame, keep the last one on screen
+            anim.event_source.stop()
+            fps_text.set_color('red')
+            fps_text.set_text('Acquisition stopped: ' + str(error))
+            return [line for ch_num, line in lines] + [fps_text]
+        for ch_num, line in lines:
+            line.set_data(*data[ch_num])
+        now = timer()
+        if now - rate['time'] >= 1.0:
+            fps_text.set_text('%.1f fps' % ((frames - rate['frames']) / (now - rate['time'])))
+            rate['time'] = now
+            rate['frames'] = frames
+        return [line for ch_num, line in lines] + [fps_text]
+
+    anim = animation.FuncAnimation(fig, update, interval=30, blit=True, cache_frame_data=False)
+    plt.show()
+    stop.set()
+    thread.join()
+    if latest['error'] is not None:
+        raise latest['error']
+    return anim
+
+
+# Read the scope, or the file given with --input
+def load_scope(args):
+    if len(args.input) > 0:
+        # Import scope data from file, also the shelve files saved before the capture format
+        return scope_capture.open_scope(args.input)
+    # Create scope object and retrieve data
+    scp = scope.DS1000(args.device, args.channels)
+    if args.mode == 'RAW':
+        # the scope only measures the 600 points on screen, measure the whole record instead
+        scp.set_measurements(scope.CLIENT_MEASUREMENTS)
+    scp.query_scope(args.mode)
+    return scp
+
+
+def plot(scp, args):
+    import scope_render
+
+    plt = import_pyplot()
+    # Create figure and use date and time as title which doubles as default filename when saving image.
+    fig = plt.figure(scp.retrieval_date.strftime("%Y%m%d_%H%M%S") + "_scope_output")
+    renderer = scope_render.Renderer(fig, style=args.style, printer_friendly=args.printfriendly,
+                                     spectrum=args.spectrum)
+    renderer.draw(scp)
+
+    # Maximizes plots in figure canvas.
+    def on_resize(event):
+        renderer.tight_layout()
+        fig.canvas.draw_idle()
+    fig.canvas.mpl_connect('resize_event', on_resize)
+
+    plt.show()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.live:
+        run_live(args)
+        return 0
+    scp = load_scope(args)
+    if len(args.output) > 0:
+        # Export scope data to file
+        scope_capture.save(scp, args.output)
+    if not args.no_plot:
+        plot(scp, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
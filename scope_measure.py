@@ -0,0 +1,236 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Waveform measurements computed from the samples instead of queried with :MEAS.  They use
+# the whole record (the scope only measures the 600 points on screen), work in RAW mode and
+# give NaN rather than sentinel values when something can't be measured.
+#
+# measure() takes one waveform or a 2D array of them, one per row, and works on all rows
+# at once:
+#
+#     m = scope_measure.measure_channel(scp.get_channel(1))
+#     print(m.freq, m.rise_time, m.overshoot)
+#
+# Levels follow the scope: Vtop and Vbase are the most common levels in the upper and lower
+# half of the range, Vamp = Vtop - Vbase.  Frequency and duty cycle use crossings of the
+# middle level with HYSTERESIS so noise doesn't add edges; rise and fall times are between
+# the LOW and HIGH reference levels.
+
+import numpy as np
+from collections import namedtuple
+import rigolusb
+
+Measurements = namedtuple('Measurements', ['vmax', 'vmin', 'vpp', 'vtop', 'vbase', 'vamp', 'vavg', 'vrms',
+                                           'freq', 'period', 'pos_duty', 'neg_duty', 'rise_time',
+                                           'fall_time', 'overshoot', 'preshoot'])
+
+LEVEL_BINS = 256   # histogram bins used to find Vtop and Vbase
+LEVEL_MIN_FRACTION = 0.01  # a level holds at least this fraction of the samples
+LEVEL_PEAK = 4.0   # and this many times the average count in its half of the range
+HYSTERESIS = 0.1   # fraction of Vamp the signal has to move past the middle level
+LOW = 0.1          # rise and fall time reference levels as fractions of Vamp
+HIGH = 0.9
+
+
+def _top_base(v, vmin, vpp):
+    num_rows = v.shape[0]
+    step = np.where(vpp > 0, vpp, 1.0) / (LEVEL_BINS - 1)
+    levels = np.rint((v - vmin[:, None]) / step[:, None]).astype(np.intp)
+    levels += (np.arange(num_rows) * LEVEL_BINS)[:, None]
+    counts = np.bincount(levels.ravel(), minlength=num_rows * LEVEL_BINS).reshape(num_rows, LEVEL_BINS)
+    half = LEVEL_BINS // 2
+    top = LEVEL_BINS - 1 - counts[:, :half - 1:-1].argmax(axis=1)  # ties go to the outermost level
+    base = counts[:, :half].argmax(axis=1)
+    rows = np.arange(num_rows)
+    # without a clear flat level (e.g. a sine) use the extremes, as the scope does
+    top = np.where(_is_level(counts[rows, top], counts[:, half:], v.shape[1]), top, LEVEL_BINS - 1)
+    base = np.where(_is_level(counts[rows, base], counts[:, :half], v.shape[1]), base, 0)
+    flat = vpp <= 0
+    return np.where(flat, vmin, vmin + top * step), np.where(flat, vmin, vmin + base * step)
+
+
+def _is_level(peak, counts, num_points):
+    return (peak >= LEVEL_MIN_FRACTION * num_points) & (peak >= LEVEL_PEAK * counts.mean(axis=1))
+
+
+# Schmitt trigger over every row: True once a sample is above hi, False once below lo.
+# Also returns, for each sample, the index of the last sample above hi or below lo (-1
+# before the first one).
+def _states(v, lo, hi):
+    high = v > hi[:, None]
+    last = np.where(high | (v < lo[:, None]), np.arange(v.shape[1]), -1)
+    np.maximum.accumulate(last, axis=1, out=last)
+    rows = np.arange(v.shape[0])[:, None]
+    return high[rows, np.maximum(last, 0)] & (last >= 0), last
+
+
+# Rows and sample indices where the state goes low to high (rising) or high to low
+def _edges(state, last, rising):
+    if rising:
+        edges = ~state[:, :-1] & state[:, 1:] & (last[:, :-1] >= 0)
+    else:
+        edges = state[:, :-1] & ~state[:, 1:]
+    rows, cols = np.nonzero(edges)
+    return rows, cols + 1
+
+
+# Fractional sample index where rows of v cross level between samples i and i + 1
+def _crossing(v, rows, i, level):
+    a = v[rows, i]
+    b = v[rows, i + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(b != a, (level[rows] - a) / (b - a), 0.0)
+    return i + np.clip(frac, 0.0, 1.0)
+
+
+def _first_last(rows, values, num_rows):
+    count = np.bincount(rows, minlength=num_rows)
+    ends = np.cumsum(count)
+    starts = ends - count
+    found = count > 0
+    first = np.full(num_rows, np.nan)
+    last = np.full(num_rows, np.nan)
+    first[found] = values[starts[found]]
+    last[found] = values[ends[found] - 1]
+    return count, first, last
+
+
+def _mean(rows, values, num_rows):
+    count = np.bincount(rows, minlength=num_rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, np.bincount(rows, weights=values, minlength=num_rows) / count, np.nan)
+
+
+def _timing(v, sample_rate, vtop, vbase, vamp):
+    num_rows = v.shape[0]
+    with np.errstate(invalid='ignore'):
+        usable = vamp > 0
+    middle = (vtop + vbase) / 2
+    hysteresis = np.where(usable, HYSTERESIS * vamp, np.inf)
+
+    # frequency and duty cycle from whole periods between the first and last rising edge
+    state, last = _states(v, middle - hysteresis, middle + hysteresis)
+    rows, cols = _edges(state, last, True)
+    times = _crossing(v, rows, cols - 1, middle + hysteresis)
+    count, first, final = _first_last(rows, times, num_rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        period = np.where(count > 1, (final - first) / (count - 1), np.nan) / sample_rate
+    count, first_i, final_i = _first_last(rows, cols, num_rows)
+    high_samples = np.cumsum(state, axis=1)
+    whole = count > 1
+    pos_duty = np.full(num_rows, np.nan)
+    if whole.any():
+        r = np.nonzero(whole)[0]
+        start = first_i[r].astype(np.intp)
+        stop = final_i[r].astype(np.intp)
+        pos_duty[r] = 100.0 * (high_samples[r, stop] - high_samples[r, start]) / (stop - start)
+
+    # rise and fall times between the LOW and HIGH levels, averaged over all edges
+    low = np.where(usable, vbase + LOW * vamp, np.inf)
+    high = np.where(usable, vbase + HIGH * vamp, np.inf)
+    state, last = _states(v, low, high)
+    rows, cols = _edges(state, last, True)
+    start = last[rows, cols - 1]  # last sample below LOW
+    rise = _mean(rows, _crossing(v, rows, cols - 1, high) - _crossing(v, rows, start, low), num_rows)
+    rows, cols = _edges(state, last, False)
+    start = last[rows, cols - 1]  # last sample above HIGH
+    fall = _mean(rows, _crossing(v, rows, cols - 1, low) - _crossing(v, rows, start, high), num_rows)
+    return period, pos_duty, rise / sample_rate, fall / sample_rate
+
+
+def measure(volts, sample_rate):
+    """ Measurements of one waveform, or of each row of a 2D array of waveforms with one
+        sample_rate or one per row.  Gives floats for one waveform and arrays otherwise. """
+    v = np.asarray(volts, dtype=np.float64)
+    single = v.ndim == 1
+    v = np.atleast_2d(v)
+    num_rows = v.shape[0]
+    sample_rate = np.broadcast_to(np.asarray(sample_rate, dtype=np.float64), (num_rows,))
+
+    vmax = v.max(axis=1)
+    vmin = v.min(axis=1)
+    vpp = vmax - vmin
+    vtop, vbase = _top_base(v, vmin, vpp)
+    vamp = vtop - vbase
+    vavg = v.mean(axis=1)
+    vrms = np.sqrt(np.einsum('ij,ij->i', v, v) / v.shape[1])
+    period, pos_duty, rise_time, fall_time = _timing(v, sample_rate, vtop, vbase, vamp)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freq = 1.0 / period
+        overshoot = np.where(vamp > 0, 100.0 * (vmax - vtop) / vamp, np.nan)
+        preshoot = np.where(vamp > 0, 100.0 * (vbase - vmin) / vamp, np.nan)
+
+    result = Measurements(vmax, vmin, vpp, vtop, vbase, vamp, vavg, vrms, freq, period, pos_duty,
+                          100.0 - pos_duty, rise_time, fall_time, overshoot, preshoot)
+    if single:
+        return Measurements(*[float(values[0]) for values in result])
+    return result
+
+
+def measure_channel(ch):
+    return measure(ch.volt_points, ch.sample_rate)
+
+
+def measure_channels(channels):
+    """ Measurements of each channel, in one pass over the channels with the same number of
+        points (e.g. the same channel of many captures) """
+    results = [None] * len(channels)
+    by_length = {}
+    for i, ch in enumerate(channels):
+        by_length.setdefault(ch.num_points, []).append(i)
+    for num_points, indices in by_length.items():
+        volts = np.stack([channels[i].volt_points for i in indices])
+        batch = measure(volts, [channels[i].sample_rate for i in indices])
+        for row, i in enumerate(indices):
+            results[i] = Measurements(*[float(values[row]) for values in batch])
+    return results
+
+
+# The subset the scope's :MEAS queries give, to the scope's 4 significant digits and with
+# the same sentinels for what can't be measured, so it can stand in for
+# rigolusb.get_measurements
+def to_scope_measurements(m):
+    def rounded(value):
+        return float('%.4g' % value)
+
+    duty = '***/***'
+    if not np.isnan(m.pos_duty):
+        duty = str(round(m.pos_duty, 3)) + '/' + str(round(m.neg_duty, 3))
+    return rigolusb.Measurements(rounded(m.vmax), rounded(m.vmin), rounded(m.vpp),
+                                 '***' if np.isnan(m.vamp) else rounded(m.vamp), rounded(m.vrms),
+                                 '********' if np.isnan(m.freq) else rounded(m.freq), duty)
+
+
+def _format(value, unit):
+    if np.isnan(value):
+        return '***'
+    return '%.4g' % value + unit
+
+
+# Measurements as text for the plot, like Channel.meas_string with rise and fall times
+def measures_string(m):
+    return ('Vmax=' + _format(m.vmax, 'V') + ',  ' +
+            'Vmin=' + _format(m.vmin, 'V') + ',  ' +
+            'Vrms=' + _format(m.vrms, 'V') + ',  ' +
+            'Vamp=' + _format(m.vamp, 'V') + ',  ' +
+            'Freq=' + _format(m.freq, 'Hz') + ',  ' +
+            'Duty=' + _format(m.pos_duty, '') + '/' + _format(m.neg_duty, '%') + ',  ' +
+            'Rise=' + _format(m.rise_time, 's') + ',  ' +
+            'Fall=' + _format(m.fall_time, 's'))
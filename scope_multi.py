@@ -0,0 +1,169 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Captures from several scopes at once.  rigolusb keeps a lock per device, so each scope is
+# driven from its own thread and the USB transfers overlap:
+#
+#     with scope_multi.MultiScope(['/dev/usbtmc1', '/dev/usbtmc2']) as scopes:
+#         frame_set = scopes.capture('RAW')
+#         for scp in frame_set:
+#             print(scp.id, scp.retrieval_date)
+
+import threading
+from multiprocessing.pool import ThreadPool
+import rigolusb
+import scope
+
+
+class _Gate(object):
+    """ Releases every waiting thread at once when the last of parties arrives.  Stands in
+        for threading.Barrier, which Python 2 doesn't have.  Each gate is used once. """
+
+    def __init__(self, parties):
+        self._parties = parties
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._open = threading.Event()
+
+    def wait(self):
+        with self._lock:
+            self._waiting += 1
+            if self._waiting >= self._parties:
+                self._open.set()
+        self._open.wait()
+
+
+_Barrier = getattr(threading, 'Barrier', _Gate)
+
+
+class FrameSet(object):
+    """ One capture from every scope of a MultiScope, in the order the devices were given.
+        All scopes are released together so their :STOP commands go out at nearly the same
+        time; skew is the spread of their retrieval dates in seconds. """
+
+    def __init__(self, index, scopes):
+        self._index = index
+        self._scopes = scopes
+        dates = [scp.retrieval_date for scp in scopes]
+        self._skew = (max(dates) - min(dates)).total_seconds() if dates else 0.0
+
+    def __iter__(self):
+        return iter(self._scopes)
+
+    def __len__(self):
+        return len(self._scopes)
+
+    def __getitem__(self, i):
+        return self._scopes[i]
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def scopes(self):
+        return self._scopes
+
+    @property
+    def skew(self):
+        return self._skew
+
+
+class MultiScope(object):
+    """ Captures several scopes concurrently, one worker thread and session per device.
+        Every capture returns new DS1000 objects, so FrameSets stay valid. """
+
+    def __init__(self, device_paths, num_channels=2):
+        self._device_paths = list(device_paths)
+        self._num_channels = num_channels
+        self._sessions = []
+        self._pool = None
+        self._count = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self._pool is None:
+            try:
+                for path in self._device_paths:
+                    self._sessions.append(rigolusb.Session(path).open())
+            except Exception:
+                self.close()
+                raise
+            self._pool = ThreadPool(len(self._device_paths))
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        for session in self._sessions:
+            session.close()
+        self._sessions = []
+
+    def capture(self, _waveform_pnts_mode='NOR'):
+        """ Captures every scope at once and returns a FrameSet """
+        own = self._pool is None
+        if own:
+            self.open()
+        try:
+            gate = _Barrier(len(self._sessions))
+
+            def query(session):
+                scp = scope.DS1000(session.device_path, self._num_channels)
+                gate.wait()
+                scp.query_scope(_waveform_pnts_mode, session)
+                return scp
+
+            frame_set = FrameSet(self._count, self._pool.map(query, self._sessions))
+            self._count += 1
+            return frame_set
+        finally:
+            if own:
+                self.close()
+
+    def captures(self, _waveform_pnts_mode='NOR', count=None):
+        """ Yields FrameSets back-to-back, count of them or forever when None.  Opens the
+            sessions for the duration unless they are already open. """
+        own = self._pool is None
+        if own:
+            self.open()
+        try:
+            num_captures = 0
+            while count is None or num_captures < count:
+                yield self.capture(_waveform_pnts_mode)
+                num_captures += 1
+        finally:
+            if own:
+                self.close()
+
+    @property
+    def device_paths(self):
+        return self._device_paths
+
+    @property
+    def num_scopes(self):
+        return len(self._device_paths)
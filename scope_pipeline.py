@@ -0,0 +1,260 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Pipelined acquisition: one thread reads frames from the scope while other threads, one
+# per stage, process the frames read before, so the USB transfer of the next frame overlaps
+# the volt conversion, measurement and saving of the current one.
+#
+#     with scope_archive.ArchiveWriter('run.rca') as writer:
+#         pipeline = scope_pipeline.Pipeline(scp, [('volts', scope_pipeline.convert),
+#                                                  ('measure', scope_pipeline.measure),
+#                                                  ('save', scope_pipeline.archive(writer, scp))], 'RAW')
+#         pipeline.run(100)
+#     print(pipeline.summary())
+#
+# Frames come from a pool of ring_size reusable Frames (see DS1000.stream) and go back to it
+# after the last stage, so at most ring_size frames are in memory.  Stages are connected by
+# queues of at most queue_size frames.  Each stage's busy and waiting times are kept as
+# rigolusb.Histograms: the stage busy the longest per frame is the bottleneck, and the
+# others spend that time waiting.
+
+import threading
+from collections import namedtuple
+from timeit import default_timer as timer
+import rigolusb
+import scope
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+ACQUIRE = 'acquire'  # name of the stage reading from the scope
+
+StageTimings = namedtuple('StageTimings', ['busy', 'wait'])  # rigolusb.Histograms
+
+
+# Stage that converts every channel to volts
+def convert(frame):
+    frame.volt_points
+
+
+# Stage that measures every channel with scope_measure, see Frame.get_measurements
+def measure(frame):
+    for ch_num in frame.raw_points:
+        frame.get_measurements(ch_num)
+
+
+# Stage that appends frames to a scope_archive.ArchiveWriter
+def archive(writer, scp):
+    def append(frame):
+        writer.append(scp, frame)
+    return append
+
+
+# Stage that keeps frames in a scope.History
+def history(frames, scp):
+    def append(frame):
+        frames.append(scp, frame)
+    return append
+
+
+class Pipeline(object):
+    """ Acquires frames from scp in _waveform_pnts_mode and passes each one through stages,
+        a list of (name, function of a Frame) run in order on threads of their own.  rearm
+        and timeout are as for DS1000.stream. """
+
+    def __init__(self, scp, stages, _waveform_pnts_mode='NOR', ring_size=4, queue_size=2, rearm=scope.SINGLE,
+                 timeout=5.0):
+        if not stages:
+            raise ValueError('a pipeline needs at least one stage')
+        self._scp = scp
+        self._stages = list(stages)
+        self._waveform_pnts_mode = _waveform_pnts_mode
+        self._ring_size = max(ring_size, 1)
+        self._queue_size = max(queue_size, 1)
+        self._rearm = rearm
+        self._timeout = timeout
+        self._stop = threading.Event()
+        self._threads = []
+        self._error = None
+        self._count = 0
+        self._elapsed = 0.0
+        self._started = None
+        self._timings = self._new_timings()
+
+    def _new_timings(self):
+        return dict((name, StageTimings(rigolusb.Histogram(), rigolusb.Histogram()))
+                    for name in [ACQUIRE] + [name for name, function in self._stages])
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _acquire(self, free, target, count):
+        scp = self._scp
+        timings = self._timings[ACQUIRE]
+        session = None
+        own_session = False
+        try:
+            session = scp._session
+            own_session = session is None
+            if own_session:
+                session = rigolusb.Session(scp._device_path).open()
+            os_file = session.os_file
+            scp._waveform_pnts_mode = self._waveform_pnts_mode
+            scp._load_settings(session)
+            if self._rearm == scope.RUN:
+                rigolusb.set_run(os_file)
+            index = 0
+            while (count is None or index < count) and not self._stop.is_set():
+                start = timer()
+                frame = None
+                while frame is None and not self._stop.is_set():
+                    try:
+                        frame = free.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                if frame is None:
+                    break
+                acquiring = timer()
+                scp._acquire_frame(os_file, frame, self._rearm, self._timeout)
+                frame._index = index
+                index += 1
+                timings.wait.add(acquiring - start)
+                timings.busy.add(timer() - acquiring)
+                target.put(frame)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            target.put(None)
+            if own_session and session is not None:
+                session.close()
+
+    # Runs function on every frame from source, unless a stage has failed, and hands the
+    # frame on to target (or back to free after the last stage)
+    def _run_stage(self, name, function, source, target, free):
+        timings = self._timings[name]
+        while True:
+            start = timer()
+            frame = source.get()
+            if frame is None:
+                break
+            running = timer()
+            if self._error is None:
+                try:
+                    function(frame)
+                except Exception as e:
+                    self._fail(e)
+            timings.wait.add(running - start)
+            timings.busy.add(timer() - running)
+            if target is None:
+                if self._error is None:
+                    self._count += 1
+                free.put(frame)
+            else:
+                target.put(frame)
+        if target is not None:
+            target.put(None)
+
+    def start(self, count=None):
+        """ Starts acquiring count frames, or until stop() when None """
+        if self._threads:
+            raise RuntimeError('pipeline already started')
+        self._stop.clear()
+        self._error = None
+        self._count = 0
+        self._timings = self._new_timings()
+        free = queue.Queue()
+        for i in range(self._ring_size):
+            free.put(scope.Frame())
+        queues = [queue.Queue(self._queue_size) for stage in self._stages]
+        self._threads.append(threading.Thread(target=self._acquire, args=(free, queues[0], count),
+                                              name='Pipeline.' + ACQUIRE))
+        for i, (name, function) in enumerate(self._stages):
+            target = queues[i + 1] if i + 1 < len(queues) else None
+            self._threads.append(threading.Thread(target=self._run_stage,
+                                                  args=(name, function, queues[i], target, free),
+                                                  name='Pipeline.' + name))
+        self._started = timer()
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """ Stops acquiring; the frames being processed still go through all stages """
+        self._stop.set()
+
+    def join(self):
+        """ Waits for the pipeline to finish and raises the first error of any stage """
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._started is not None:
+            self._elapsed = timer() - self._started
+            self._started = None
+        if self._error is not None:
+            raise self._error
+
+    def run(self, count=None):
+        """ Runs count frames (or until stop() from another thread) through the pipeline and
+            returns the number of frames that went through every stage """
+        self.start(count)
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+            raise
+        return self._count
+
+    @property
+    def timings(self):
+        """ StageTimings of the last run by stage name, ACQUIRE for reading from the scope """
+        return self._timings
+
+    # Name of the stage busy longest per frame, which sets the pipeline's frame rate
+    @property
+    def bottleneck(self):
+        names = [ACQUIRE] + [name for name, function in self._stages]
+        return max(names, key=lambda name: self._timings[name].busy.mean)
+
+    # Frames that went through every stage
+    @property
+    def count(self):
+        return self._count
+
+    # Seconds the last run took
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    def summary(self):
+        """ A table of the time each stage was busy and waiting """
+        lines = ['%-12s %6s %10s %10s %10s %10s %6s' % ('stage', 'frames', 'busy', 'p90', 'total', 'waiting', 'load')]
+        for name in [ACQUIRE] + [name for name, function in self._stages]:
+            busy, wait = self._timings[name]
+            load = busy.total / self._elapsed if self._elapsed else 0.0
+            lines.append('%-12s %6d %10.6f %10.6f %10.6f %10.6f %5.0f%%' %
+                         (name[:12], busy.count, busy.mean, busy.percentile(90), busy.total, wait.total, 100 * load))
+        if self._count:
+            lines.append('%d frames in %.3f s, %.2f frames/s, bottleneck: %s' %
+                         (self._count, self._elapsed, self._count / self._elapsed, self.bottleneck))
+        return '\n'.join(lines)
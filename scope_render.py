@@ -0,0 +1,322 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Draws DS1000 captures the way scope_gui shows them, without a display.
+#
+#     renderer = scope_render.Renderer()
+#     for path in paths:
+#         renderer.render(scope_capture.load(path), path + '.png')
+#
+# A Renderer keeps one figure and only updates its lines and text from one capture to the
+# next; the axes are rebuilt only when the active channels change.  From a shell a folder
+# of captures is rendered with one Renderer per worker process:
+#
+#     python scope_render.py captures/ -o images/              Note: one process per core
+#     python scope_render.py captures/ -o images/ -r -p -f svg  Note: subdirectories too, print
+#                                                                     friendly, as svg
+
+import os
+import sys
+import argparse
+import multiprocessing
+import numpy as np
+from matplotlib import gridspec
+from matplotlib.ticker import EngFormatter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import scope
+import scope_capture
+import scope_measure
+import scope_spectrum
+
+# Set colors based on whether we intend to print or just view on monitor
+SCREEN_COLORS = {'background': 'black', 'grid': 'white', 'plot': ['yellow', 'cyan', 'deeppink', 'lightblue']}
+PRINT_COLORS = {'background': 'white', 'grid': 'black', 'plot': ['black', 'black', 'black', 'black']}
+
+SPECTRUM_RANGE = 120  # dB shown below the highest peak of the spectrum panel
+
+
+# Color of a channel's lines, repeating the colors for scopes with more channels than colors
+def plot_color(colors, ch_num):
+    return colors['plot'][(ch_num - 1) % len(colors['plot'])]
+
+
+# Calculate min and max initial display points so that amount of data displayed matches scope.
+def calc_display_range(scp):
+    if scp.points_per_channel == 600:  # zoom out to all points
+        return 0, 599
+    x_mid = round(len(scp.time_axis[scope.SAMPLES])/2)
+    total_points_displayed = (scp.time_per_division * 12) * scp.samplerate_per_channel
+    x_min = int(x_mid - round(total_points_displayed/2))
+    x_max = int(x_mid + round(total_points_displayed/2))
+    if x_min < 0:
+        x_min = 0
+    if x_max > (len(scp.time_axis[scope.SAMPLES])-1):
+        x_max = int(len(scp.time_axis[scope.SAMPLES])-1)
+    return x_min, x_max
+
+
+# Measurements shown at the bottom of a channel: the scope's for 600 point captures, which
+# it measures on screen, scope_measure's of the whole record otherwise
+def measures_text(ch):
+    if ch.num_points == 600:
+        return ch.meas_string
+    return scope_measure.measures_string(ch.measurements)
+
+
+class Renderer(object):
+    """ Draws captures into one reusable figure.  Without a figure it makes its own, drawn
+        with Agg so no display is needed; scope_gui passes in a pyplot figure instead.
+        Every channel is min/max decimated to about two points per pixel of the visible
+        time range, again whenever that range changes.  With spectrum a panel below the
+        channels shows their scope_spectrum power spectra. """
+
+    def __init__(self, fig=None, size=(12, 8), dpi=100, style='lines', printer_friendly=False, spectrum=False):
+        if fig is None:
+            fig = Figure(figsize=size, dpi=dpi)
+            FigureCanvasAgg(fig)
+        self._fig = fig
+        self._style = style
+        self._colors = PRINT_COLORS if printer_friendly else SCREEN_COLORS
+        self._spectrum = spectrum
+        self._title = fig.suptitle('', weight='bold')
+        self._layout = None   # channel numbers the axes were built for
+        self._gs = None
+        self._mem_ax = None
+        self._mem_all = None  # the whole record in the memory map
+        self._mem_window = None  # the part shown
+        self._axes = []       # per active channel: (ax, line, measures text, points text)
+        self._spectrum_ax = None
+        self._spectrum_lines = []  # per active channel
+        self._scp = None
+
+    @property
+    def figure(self):
+        return self._fig
+
+    @property
+    def axes(self):
+        return [ax for ax, line, meas_text, points_text in self._axes]
+
+    def _build(self, layout):
+        self._fig.clear()
+        self._title = self._fig.suptitle('', weight='bold')
+        self._axes = []
+        self._mem_ax = None
+        self._spectrum_ax = None
+        self._spectrum_lines = []
+        self._layout = layout
+        colors = self._colors
+        if len(layout) == 0:
+            self._gs = gridspec.GridSpec(1, 1)
+            self._fig.add_subplot(self._gs[0])
+            self._fig.text(0.45, 0.5, ' All Channels Off', color='black', weight='roman', size='small')
+            return
+
+        num_panels = len(layout) + (1 if self._spectrum else 0)
+        h_ratios = [round((num_panels * 20) / 12.0)] + [20] * num_panels
+        self._gs = gridspec.GridSpec(num_panels + 1, 1, height_ratios=h_ratios)
+        ch_ax_ref = None
+        for num, ch_num in enumerate(layout):
+            ax_color = plot_color(colors, ch_num)
+            ch_ax = self._fig.add_subplot(self._gs[num + 1], sharex=ch_ax_ref)
+            ch_ax_ref = ch_ax_ref or ch_ax
+            ch_ax.margins(y=0.2)
+            ch_ax.set_title("Channel " + str(ch_num))
+            ch_ax.set_ylabel("Voltage (V)")
+            ch_ax.set_facecolor(colors['background'])
+            ch_ax.grid(color=colors['grid'])
+            if self._style == 'dots':
+                line, = ch_ax.plot([], [], linestyle='', marker='.', color=ax_color)
+            else:
+                line, = ch_ax.plot([], [], color=ax_color)
+            meas_text = ch_ax.text(0.01, 0.01, '', ha="left", va="bottom", size='small',
+                                   transform=ch_ax.transAxes, color=ax_color)
+            points_text = ch_ax.text(0.99, 0.98, '', ha="right", va="top", size='small',
+                                     transform=ch_ax.transAxes, color=ax_color)
+            self._axes.append((ch_ax, line, meas_text, points_text))
+        ch_ax_ref.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        if self._spectrum:
+            self._build_spectrum(layout)
+
+        # Depicts waveform window in memory similar to top center graphic on Rigol scope.
+        ax = self._mem_ax = self._fig.add_subplot(self._gs[0])
+        ax.set_title("Waveform Window in Memory")
+        ax.tick_params(axis='both', which='both', bottom=False, top=False,
+                       left=False, right=False, labelleft=False, labelbottom=False)
+        self._mem_all, = ax.plot([0, 1], [1, 1], lw=1, color='black')
+        self._mem_window, = ax.plot([0, 1], [1, 1], lw=3, marker='s', color='black')
+        ax.set_navigate(False)
+        self.tight_layout()
+
+    def _build_spectrum(self, layout):
+        colors = self._colors
+        ax = self._spectrum_ax = self._fig.add_subplot(self._gs[len(layout) + 1])
+        ax.set_title("Spectrum")
+        ax.set_xlabel("Frequency")
+        ax.set_ylabel("Power (dBV)")
+        ax.xaxis.set_major_formatter(EngFormatter(unit='Hz'))
+        ax.set_facecolor(colors['background'])
+        ax.grid(color=colors['grid'])
+        for ch_num in layout:
+            line, = ax.plot([], [], lw=1, color=plot_color(colors, ch_num), label="Channel " + str(ch_num))
+            self._spectrum_lines.append(line)
+        ax.legend(loc='upper right', fontsize='small')
+
+    def _draw_spectrum(self, scp):
+        top = -np.inf
+        for ch, line in zip(scp.active_channels, self._spectrum_lines):
+            welch = scope_spectrum.channel_spectrum(ch, sample_rate=scope_spectrum.record_sample_rate(scp, ch))
+            dbv = welch.dbv
+            line.set_data(welch.frequencies, dbv)
+            top = max(top, dbv.max())
+            nyquist = welch.frequencies[-1]
+        self._spectrum_ax.set_xlim(0, nyquist)
+        if np.isfinite(top):
+            self._spectrum_ax.set_ylim(top - SPECTRUM_RANGE, top + 10)
+
+    def tight_layout(self):
+        if self._gs is not None:
+            self._gs.tight_layout(self._fig, rect=[0.01, 0, 1, 0.95])
+
+    # Replots every channel with about two points per pixel of the visible time range, picked
+    # from the channel's min/max pyramid so glitches stay visible at any zoom level.
+    def _on_xlim_changed(self, ax):
+        scp = self._scp
+        t = scp.time_axis[scope.SAMPLES]
+        xlim = ax.get_xlim()
+        lo, hi = np.searchsorted(t, xlim)
+        width = ax.get_window_extent().width
+        for ch, (ch_ax, line, meas_text, points_text) in zip(scp.active_channels, self._axes):
+            indices = ch.pyramid.indices(lo - 1, hi + 1, width)
+            line.set_data(t[indices], ch.volt_points[indices])
+        self._mem_window.set_xdata(np.asarray(xlim))
+
+    def draw(self, scp):
+        """ Shows scp in the figure """
+        self._scp = scp
+        layout = tuple(ch.ch_num for ch in scp.active_channels)
+        if layout != self._layout:
+            self._build(layout)
+        self._title.set_text(scp.retrieval_date.strftime("     %x   %X"))
+        if len(layout) == 0:
+            return
+        t = scp.time_axis[scope.SAMPLES]
+        x_min, x_max = calc_display_range(scp)
+        self._mem_ax.set_xlim(t[0], t[-1])
+        self._mem_all.set_xdata(np.asarray([t[0], t[-1]]))
+        for ch, (ch_ax, line, meas_text, points_text) in zip(scp.active_channels, self._axes):
+            ch_ax.set_xlabel("Time " + scp.time_axis[scope.UNITS])
+            meas_text.set_text(measures_text(ch))
+            points_text.set_text(ch.num_points_abbr + " Points")
+            # start with the whole record decimated so the y axis scales to all of it
+            indices = ch.pyramid.indices(0, ch.num_points, ch_ax.get_window_extent().width)
+            line.set_data(t[indices], ch.volt_points[indices])
+            ch_ax.relim()
+            ch_ax.autoscale_view(scalex=False)
+        # shared x axis, so this redecimates every channel to the visible range
+        self._axes[0][0].set_xlim(t[x_min], t[x_max])
+        if self._spectrum:
+            self._draw_spectrum(scp)
+
+    def save(self, path, **kwargs):
+        self._fig.savefig(path, **kwargs)
+
+    def render(self, scp, path, **kwargs):
+        """ Draws scp and saves the figure to path, in the format its extension names """
+        self.draw(scp)
+        self.save(path, **kwargs)
+
+
+_worker = {}
+
+
+def _init_worker(options):
+    _worker['renderer'] = Renderer(**options)
+
+
+def _render_file(paths):
+    capture_path, image_path = paths
+    try:
+        image_dir = os.path.dirname(image_path)
+        if image_dir and not os.path.isdir(image_dir):
+            try:
+                os.makedirs(image_dir)
+            except OSError:  # made by another worker in the meantime
+                pass
+        _worker['renderer'].render(scope_capture.open_scope(capture_path), image_path)
+        return capture_path, None
+    except Exception as e:
+        return capture_path, str(e)
+
+
+def render_files(paths, jobs=None, chunksize=4, errors=sys.stderr, **options):
+    """ Renders (capture path, image path) pairs in a pool of processes with one Renderer
+        each, made with options.  Returns the number of images written. """
+    count = 0
+    pool = multiprocessing.Pool(jobs, _init_worker, (options,))
+    try:
+        for capture_path, error in pool.imap_unordered(_render_file, paths, chunksize):
+            if error is not None:
+                errors.write(capture_path + ': ' + error + '\n')
+            else:
+                count += 1
+    finally:
+        pool.close()
+        pool.join()
+    return count
+
+
+# Image paths under output_dir that mirror where the captures are under directories
+def image_paths(directories, output_dir, image_format='png', pattern='*', recursive=False):
+    for directory in directories:
+        for path in scope_capture.find_captures([directory], pattern, recursive):
+            name = os.path.splitext(os.path.relpath(path, directory))[0] + '.' + image_format
+            yield path, os.path.join(output_dir, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a directory of scope capture files to images')
+    parser.add_argument('directories', help='directories holding capture files', nargs='+')
+    parser.add_argument('-o', '--output', help='directory for the images', required=True)
+    parser.add_argument('-f', '--format', help='image format, e.g. png, svg or pdf', default='png')
+    parser.add_argument('--pattern', help='capture file name pattern, e.g. "*.dat"', default='*')
+    parser.add_argument('-r', '--recursive', help='include subdirectories', action='store_true')
+    parser.add_argument('-p', '--printfriendly', help='Uses white background and black lines and text',
+                        action='store_true')
+    parser.add_argument('-s', '--style', help='Graph data using dots or lines', default='lines',
+                        choices=['lines', 'dots'])
+    parser.add_argument('-S', '--spectrum', help='add a panel with the spectrum of each channel',
+                        action='store_true')
+    parser.add_argument('--width', help='image width in inches', type=float, default=12)
+    parser.add_argument('--height', help='image height in inches', type=float, default=8)
+    parser.add_argument('--dpi', help='dots per inch', type=int, default=100)
+    parser.add_argument('-j', '--jobs', help='worker processes, default is one per core', type=int, default=None)
+    args = parser.parse_args()
+
+    paths = image_paths(args.directories, args.output, args.format, args.pattern, args.recursive)
+    count = render_files(paths, args.jobs, size=(args.width, args.height), dpi=args.dpi, style=args.style,
+                         printer_friendly=args.printfriendly, spectrum=args.spectrum)
+    sys.stderr.write(str(count) + ' images written to ' + args.output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
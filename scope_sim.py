@@ -0,0 +1,452 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Simulated Rigol DS1052E for running rigolusb, scope and scope_gui without a scope attached.
+#
+# The simulator opens a pseudo-terminal in raw mode and answers the SCPI commands used by
+# rigolusb on the master side.  The slave side (e.g. /dev/pts/7) is passed wherever a
+# /dev/usbtmcN path would normally go:
+#
+#     with scope_sim.SimulatedDS1052E(latency=0.002) as sim:
+#         scp = scope.DS1000(sim.device_path, 2)
+#         scp.query_scope('RAW')
+#
+# or from a shell:
+#
+#     python scope_sim.py --latency 0.002 &
+#     python scope_gui.py -d /dev/pts/7
+
+import os
+import re
+import pty
+import tty
+import time
+import select
+import argparse
+import threading
+import numpy as np
+
+
+IDN = 'Rigol Technologies,DS1052E,DS1ET000000000,00.04.02.01.00'
+NORMAL_MEMORY = 16384
+LONG_MEMORY = 1048576
+SCREEN_POINTS = 600
+MEAS_ERROR = 9.9e37  # what the scope reports when a measurement fails
+
+# Set commands that take no argument.  They have to be matched explicitly since several
+# commands written back-to-back (":STOP:RUN") look like a single header otherwise.
+_BARE_COMMANDS = re.compile(r'(\*RST|\*CLS|:STOP|:RUN|:SING(?:LE)?|:AUTO|:KEY:FORC)(?![A-Za-z0-9])', re.I)
+_COMMAND = re.compile(r'([:*][A-Za-z0-9]+(?::[A-Za-z0-9]+)*\??)(?:[ \t]+([^;:*\r\n]*))?')
+_SEPARATORS = re.compile(r'[;\s]*')
+_CHANNEL = re.compile(r'CHAN(?:NEL)?(\d)', re.I)
+
+
+def split_commands(data):
+    """ Splits a buffer of SCPI text into (header, argument, chained) tuples, chained being
+        True for commands joined to the previous one with ';'.  Returns the list of complete
+        commands and whatever trailing text could not be parsed yet. """
+    commands = []
+    pos = _SEPARATORS.match(data).end()
+    chained = False
+    while pos < len(data):
+        match = _BARE_COMMANDS.match(data, pos)
+        if match:
+            commands.append((match.group(1).upper(), '', chained))
+        else:
+            match = _COMMAND.match(data, pos)
+            if not match:
+                break
+            commands.append((match.group(1).upper(), (match.group(2) or '').strip(), chained))
+        pos = _SEPARATORS.match(data, match.end()).end()
+        chained = ';' in data[match.end():pos]
+    return commands, data[pos:]
+
+
+def _normalize(header):
+    # ':CHAN2:SCAL?' -> ':CHAN:SCAL?', used for latency lookups
+    return re.sub(r'(CHAN(?:NEL)?)\d', r'\1', header)
+
+
+def _format(value):
+    return '%.3e' % value
+
+
+class SimulatedChannel(object):
+    """ Front panel settings and test signal of one simulated channel """
+
+    def __init__(self, ch_num, state=1, volts_div=1.0, vert_offset=0.0, shape='sine',
+                 amplitude=1.0, frequency=1000.0, duty=0.5, noise=0.0):
+        self.ch_num = ch_num
+        self.state = state
+        self.volts_div = volts_div
+        self.vert_offset = vert_offset
+        self.shape = shape
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.duty = duty
+        self.noise = noise
+        self.raw_override = None  # uint8 array returned verbatim by :WAV:DATA? when set
+
+    def volts(self, t):
+        phase = (t * self.frequency) % 1.0
+        if self.shape == 'square':
+            v = np.where(phase < self.duty, self.amplitude, -self.amplitude)
+        elif self.shape == 'triangle':
+            v = self.amplitude * (4 * np.abs(phase - 0.5) - 1)
+        elif self.shape == 'dc':
+            v = np.full(len(t), float(self.amplitude))
+        else:
+            v = self.amplitude * np.sin(2 * np.pi * phase)
+        if self.noise:
+            v = v + np.random.RandomState(self.ch_num).normal(0, self.noise, len(t))
+        return v
+
+    def raw(self, t):
+        # inverse of the conversion in scope.Channel.load_channel_data
+        raw = 125 - (self.volts(t) + self.vert_offset) / (0.04 * self.volts_div)
+        return np.clip(np.round(raw), 0, 255).astype(np.uint8)
+
+
+class SimulatedDS1052E(object):
+    """ Scriptable stand-in for a DS1052E served over a pseudo-terminal.
+
+        latency is the delay before every command is handled and command_latency maps a
+        header (channel numbers removed, e.g. ':WAV:DATA?' or ':MEAS') to its own delay,
+        longest matching prefix wins.  transfer_rate limits response throughput in bytes
+        per second.  Commands other than *OPC? arriving sooner than min_command_interval
+        after a set command are counted in violations, like the ones a real scope would drop.
+        Commands after a query aren't checked: this assumes, as rigolusb's ADAPTIVE pacing
+        does, that a query is finished once it has been answered.
+        on_command(sim, header, argument) is called for every command received. """
+
+    def __init__(self, num_channels=2, latency=0.0, command_latency=None, transfer_rate=None,
+                 min_command_interval=0.0, long_memory=False, time_per_division=0.001,
+                 time_offset=0.0, sample_rate=None, acquire_time=0.0, idn=IDN, on_command=None):
+        self.channels = [SimulatedChannel(i + 1) for i in range(num_channels)]
+        self.latency = latency
+        self.command_latency = dict(command_latency or {})
+        self.transfer_rate = transfer_rate
+        self.min_command_interval = min_command_interval
+        self.long_memory = long_memory
+        self.time_per_division = time_per_division
+        self.time_offset = time_offset
+        self.sample_rate = sample_rate
+        self.acquire_time = acquire_time
+        self.idn = idn
+        self.on_command = on_command
+        self.waveform_pnts_mode = 'NOR'
+        self.commands = []
+        self.violations = 0
+        self.bytes_sent = 0
+        self.frame = 0
+        self._running = True
+        self._armed_at = None
+        self._last_set = None  # arrival time of the previous command when it was a set command
+        self._cache = {}
+        self._master = None
+        self._slave = None
+        self._device_path = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self._device_path = os.ttyname(self._slave)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name='scope_sim')
+        self._thread.daemon = True
+        self._thread.start()
+        return self._device_path
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = None
+        self._slave = None
+
+    @property
+    def device_path(self):
+        return self._device_path
+
+    def get_channel(self, ch_num):
+        return self.channels[ch_num - 1]
+
+    def _serve(self):
+        pending = ''
+        while not self._stop_event.is_set():
+            if not select.select([self._master], [], [], 0.05)[0]:
+                continue
+            data = os.read(self._master, 65536)
+            # let the rest of a split write arrive before parsing
+            while select.select([self._master], [], [], 0.001)[0]:
+                data += os.read(self._master, 65536)
+            arrived = time.time()
+            commands, pending = split_commands(pending + data.decode('ascii', 'replace'))
+            responses = []
+            for header, argument, chained in commands:
+                if not chained and responses:
+                    self._write_message(responses)
+                    responses = []
+                if (self._last_set is not None and header != '*OPC?' and
+                        arrived - self._last_set < self.min_command_interval):
+                    self.violations += 1
+                response = self.handle(header, argument)
+                if response is not None:
+                    responses.append(response)
+                self._last_set = arrived if response is None else None
+            if responses:
+                self._write_message(responses)
+
+    # Queries chained with ';' are answered in one message with a single terminator
+    def _write_message(self, responses):
+        if len(responses) == 1:
+            self._write(responses[0])
+        else:
+            self._write(b';'.join(r if r[:1] == b'#' else r.rstrip(b'\n') for r in responses) + b'\n')
+
+    def _write(self, response):
+        if self.transfer_rate:
+            time.sleep(len(response) / float(self.transfer_rate))
+        view = memoryview(response)
+        while len(view):
+            written = os.write(self._master, view)
+            view = view[written:]
+        self.bytes_sent += len(response)
+
+    def _latency_for(self, header):
+        key = _normalize(header)
+        for prefix in sorted(self.command_latency, key=len, reverse=True):
+            if key.startswith(prefix.upper()):
+                return self.command_latency[prefix]
+        return self.latency
+
+    def handle(self, header, argument=''):
+        """ Handles one command and returns the bytes to send back, or None for set commands """
+        self.commands.append((header + ' ' + argument).strip())
+        if self.on_command is not None:
+            self.on_command(self, header, argument)
+        delay = self._latency_for(header)
+        if delay:
+            time.sleep(delay)
+        self._update_acquisition()
+        response = self._dispatch(header, argument)
+        if response is None:
+            return None
+        if isinstance(response, str):
+            response = (response + '\n').encode('ascii')
+        return response
+
+    def _update_acquisition(self):
+        if self._armed_at is not None and time.time() - self._armed_at >= self.acquire_time:
+            self._armed_at = None
+            self._running = False
+            self.frame += 1
+
+    def _dispatch(self, header, argument):
+        ch_match = _CHANNEL.search(header) or _CHANNEL.search(argument)
+        ch = self.get_channel(int(ch_match.group(1))) if ch_match else None
+        short = _normalize(header)
+
+        if header == '*IDN?':
+            return self.idn
+        if header == '*OPC?':
+            return '1'
+        if header in ('*RST', '*CLS', ':AUTO'):
+            return None
+        if header == ':STOP':
+            self._running = False
+            self._armed_at = None
+            return None
+        if header == ':RUN':
+            self._running = True
+            self.frame += 1
+            return None
+        if header in (':SING', ':SINGLE'):
+            self._running = True
+            self._armed_at = time.time()
+            self._update_acquisition()
+            return None
+        if header == ':KEY:FORC':
+            return None
+        if header in (':TRIG:STAT?', ':TRIG:STATUS?'):
+            if self._armed_at is not None:
+                return 'WAIT'
+            return 'RUN' if self._running else 'STOP'
+        if header == ':TIM:SCAL?':
+            return _format(self.time_per_division)
+        if header == ':TIM:SCAL':
+            self.time_per_division = float(argument)
+            return None
+        if header == ':TIM:OFFS?':
+            return _format(self.time_offset)
+        if header == ':TIM:OFFS':
+            self.time_offset = float(argument)
+            return None
+        if header in (':ACQ:MEMD?', ':ACQ:MEMDEPTH?'):
+            return 'LONG' if self.long_memory else 'NORMAL'
+        if header in (':ACQ:MEMD', ':ACQ:MEMDEPTH'):
+            self.long_memory = argument.upper().startswith('LONG')
+            return None
+        if header in (':ACQ:SAMP?', ':ACQ:SAMPLINGRATE?'):
+            return '%e' % self._sample_rate()
+        if header in (':WAV:POIN:MODE', ':WAVEFORM:POINTS:MODE'):
+            self.waveform_pnts_mode = argument.upper()
+            return None
+        if header in (':WAV:POIN:MODE?', ':WAVEFORM:POINTS:MODE?'):
+            return self.waveform_pnts_mode
+        if header in (':WAV:DATA?', ':WAVEFORM:DATA?'):
+            raw = self.waveform(ch.ch_num if ch else 1)
+            return ('#8%08d' % len(raw)).encode('ascii') + raw.tobytes()
+        if ch is not None and short == ':CHAN:DISP?':
+            return str(ch.state)
+        if ch is not None and short == ':CHAN:DISP':
+            ch.state = 1 if argument.upper() in ('1', 'ON') else 0
+            return None
+        if ch is not None and short == ':CHAN:SCAL?':
+            return _format(ch.volts_div)
+        if ch is not None and short == ':CHAN:SCAL':
+            ch.volts_div = float(argument)
+            return None
+        if ch is not None and short == ':CHAN:OFFS?':
+            return _format(ch.vert_offset)
+        if ch is not None and short == ':CHAN:OFFS':
+            ch.vert_offset = float(argument)
+            return None
+        if header.startswith(':MEAS:') and header.endswith('?'):
+            return _format(self._measure(header[6:-1], ch or self.get_channel(1)))
+        return None
+
+    def _active_count(self):
+        return max(1, sum(1 for ch in self.channels if ch.state))
+
+    def _sample_rate(self):
+        if self.sample_rate:
+            return float(self.sample_rate)
+        # Roughly what the scope does: the whole memory spans about 12 divisions
+        depth = (LONG_MEMORY if self.long_memory else NORMAL_MEMORY) / self._active_count()
+        return min(1e9 / self._active_count(), depth / (12.0 * self.time_per_division))
+
+    def _num_points(self):
+        if self.waveform_pnts_mode == 'NOR' or self._running:
+            return SCREEN_POINTS
+        return int((LONG_MEMORY if self.long_memory else NORMAL_MEMORY) / self._active_count())
+
+    def _time_axis(self, num_points):
+        if num_points == SCREEN_POINTS:
+            step = self.time_per_division / 50.0
+            start = self.time_per_division * -6
+        else:
+            step = 1.0 / self._sample_rate()
+            start = -(num_points / 2.0) * step
+        return start + self.time_offset + np.arange(num_points) * step
+
+    def waveform(self, ch_num, num_points=None):
+        """ Returns the uint8 samples :WAV:DATA? would send for a channel """
+        ch = self.get_channel(ch_num)
+        if ch.raw_override is not None:
+            return np.asarray(ch.raw_override, dtype=np.uint8)
+        num_points = num_points or self._num_points()
+        key = (ch_num, num_points, self.frame, self.time_per_division, self.time_offset,
+               self._sample_rate(), ch.volts_div, ch.vert_offset, ch.shape, ch.amplitude,
+               ch.frequency, ch.duty, ch.noise)
+        slot = (ch_num, num_points)
+        cached = self._cache.get(slot)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # successive acquisitions drift in phase so frames are distinguishable
+        t = self._time_axis(num_points) + self.frame * 0.1 / max(ch.frequency, 1e-12)
+        raw = ch.raw(t)
+        self._cache[slot] = (key, raw)
+        return raw
+
+    def _measure(self, name, ch):
+        if not ch.state:
+            return MEAS_ERROR
+        raw = self.waveform(ch.ch_num, SCREEN_POINTS).astype(float)
+        volts = 5 * ch.volts_div - 0.04 * ch.volts_div * raw - ch.vert_offset
+        vmax = volts.max()
+        vmin = volts.min()
+        if name == 'VMAX':
+            return vmax
+        if name == 'VMIN':
+            return vmin
+        if name in ('VPP', 'VAMP'):
+            return vmax - vmin
+        if name == 'VRMS':
+            return np.sqrt(np.mean(volts ** 2))
+        if ch.shape == 'dc':
+            return MEAS_ERROR
+        if name == 'FREQ':
+            return ch.frequency
+        if name == 'PER':
+            return 1.0 / ch.frequency
+        duty = ch.duty if ch.shape == 'square' else 0.5
+        if name == 'PDUT':
+            return duty
+        if name == 'NDUT':
+            return 1.0 - duty
+        if name in ('PWID', 'NWID'):
+            return (duty if name == 'PWID' else 1.0 - duty) / ch.frequency
+        return MEAS_ERROR
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a simulated DS1052E on a pseudo-terminal')
+    parser.add_argument('-l', '--latency', help='per command latency in seconds', type=float, default=0.0)
+    parser.add_argument('-r', '--rate', help='transfer rate in bytes per second', type=float, default=None)
+    parser.add_argument('--long', help='use long memory (1M/512K points in RAW mode)', action='store_true')
+    parser.add_argument('--single', help='only enable channel 1', action='store_true')
+    parser.add_argument('-c', '--channels', help='number of channels, default is 2', type=int, default=2)
+    args = parser.parse_args()
+    if args.channels < 1:
+        parser.error('--channels must be at least 1')
+
+    sim = SimulatedDS1052E(num_channels=args.channels, latency=args.latency, transfer_rate=args.rate,
+                           long_memory=args.long)
+    if len(sim.channels) > 1:
+        sim.get_channel(2).shape = 'square'
+        sim.get_channel(2).frequency = 2500.0
+    if args.single:
+        for ch in sim.channels[1:]:
+            ch.state = 0
+    with sim:
+        print(sim.device_path)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
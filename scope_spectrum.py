@@ -0,0 +1,217 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Spectra of channel data, for more than the scope's FFT, which only sees the 600 points on
+# screen.  Welch's method: the record is cut into overlapping windowed segments and their
+# power spectra are averaged, which trades frequency resolution for less noise.  Averages
+# can also run over successive captures:
+#
+#     welch = scope_spectrum.Welch(captures[0].get_channel(1).sample_rate)
+#     for scp in captures:
+#         welch.add_channel(scp.get_channel(1))
+#     plot(welch.frequencies, welch.dbv)
+#
+# Segments are transformed SEGMENT_BATCH_POINTS at a time, so a 1M point record never needs
+# more than a few MB on top of its samples.  NumPy's FFT has no plans to keep, so windows
+# and their scaling are what is cached per segment length.
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+RECTANGULAR = 'rectangular'
+HANN = 'hann'
+HAMMING = 'hamming'
+BLACKMAN = 'blackman'
+FLATTOP = 'flattop'  # accurate amplitudes at the cost of wide peaks
+
+SEGMENT_POINTS = 16384  # default segment length, records up to this long are one segment
+OVERLAP = 0.5           # default fraction of a segment shared with the next
+SEGMENT_BATCH_POINTS = 1 << 18  # samples transformed at a time
+
+_FLATTOP_COEFFICIENTS = [0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368]
+_windows = {}  # (window, length) -> (window, sum, sum of squares)
+
+
+def _make_window(window, length):
+    if window == RECTANGULAR:
+        return np.ones(length)
+    elif window == HANN:
+        return np.hanning(length + 1)[:-1]  # periodic, as for spectral analysis
+    elif window == HAMMING:
+        return np.hamming(length + 1)[:-1]
+    elif window == BLACKMAN:
+        return np.blackman(length + 1)[:-1]
+    elif window == FLATTOP:
+        phase = 2 * np.pi * np.arange(length) / length
+        w = np.zeros(length)
+        for k, a in enumerate(_FLATTOP_COEFFICIENTS):
+            w += (-1) ** k * a * np.cos(k * phase)
+        return w
+    raise ValueError('unknown window: ' + str(window))
+
+
+# The window of a segment length with its sum and sum of squares, made once per length
+def get_window(window, length):
+    key = (window, length)
+    if key not in _windows:
+        w = _make_window(window, length)
+        w.flags.writeable = False
+        _windows[key] = (w, float(w.sum()), float(np.dot(w, w)))
+    return _windows[key]
+
+
+class Welch(object):
+    """ Running average of the power spectra of windowed segments, over one record or many
+        of the same sample rate.  Segments are segment_length samples (the whole record when
+        shorter, e.g. 600 points), each overlap times a segment after the previous one starts,
+        with the mean removed when detrend is set. """
+
+    def __init__(self, sample_rate, segment_length=SEGMENT_POINTS, window=HANN, overlap=OVERLAP, detrend=True):
+        if not 0 <= overlap < 1:
+            raise ValueError('overlap must be at least 0 and less than 1')
+        self._sample_rate = float(sample_rate)
+        self._segment_length = segment_length
+        self._window = window
+        self._overlap = overlap
+        self._detrend = detrend
+        self._length = None  # of the segments averaged so far
+        self._power = None
+        self._count = 0
+
+    def reset(self):
+        self._length = None
+        self._power = None
+        self._count = 0
+
+    def _segments(self, num_points):
+        if num_points == 0:
+            raise ValueError('no samples to analyze')
+        length = min(self._segment_length, num_points)
+        if self._length is not None and length != self._length:
+            raise ValueError('record of ' + str(num_points) + ' points gives segments of ' + str(length) +
+                             ' points, averaged so far are ' + str(self._length))
+        step = max(int(length * (1 - self._overlap)), 1)
+        return length, step, (num_points - length) // step + 1
+
+    def _add_segments(self, volts, length, step, count):
+        w = get_window(self._window, length)[0]
+        strided = as_strided(volts, (count, length), (volts.strides[0] * step, volts.strides[0]), writeable=False)
+        segments = strided * w
+        if self._detrend:
+            segments -= np.outer(strided.mean(axis=1), w)
+        spectra = np.fft.rfft(segments, axis=1)
+        power = np.einsum('ij,ij->j', spectra.real, spectra.real)
+        power += np.einsum('ij,ij->j', spectra.imag, spectra.imag)
+        if self._power is None:
+            self._power = power
+            self._length = length
+        else:
+            self._power += power
+        self._count += count
+
+    # Adds a record of num_points samples, getting volts[start:stop] from get_volts a batch
+    # of segments at a time
+    def _add_record(self, num_points, get_volts):
+        length, step, count = self._segments(num_points)
+        batch = max(SEGMENT_BATCH_POINTS // length, 1)
+        for first in range(0, count, batch):
+            num = min(batch, count - first)
+            start = first * step
+            volts = np.ascontiguousarray(get_volts(start, start + (num - 1) * step + length), dtype=np.float64)
+            self._add_segments(volts, length, step, num)
+
+    def add(self, volts):
+        """ Adds the segments of a record of volts """
+        volts = np.asarray(volts)
+        self._add_record(len(volts), lambda start, stop: volts[start:stop])
+
+    def add_channel(self, ch, sample_rate=None):
+        """ Adds a channel's record, converting only a batch of samples at a time to volts
+            unless they have been converted already.  sample_rate is that of the record, the
+            channel's by default (see record_sample_rate). """
+        if sample_rate is None:
+            sample_rate = ch.sample_rate
+        if sample_rate != self._sample_rate:
+            raise ValueError('channel ' + str(ch.ch_num) + ' sample rate ' + str(sample_rate) +
+                             ' differs from ' + str(self._sample_rate))
+        self._add_record(ch.num_points, ch.get_volts)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def segment_length(self):
+        return self._length
+
+    @property
+    def frequencies(self):
+        if self._length is None:
+            return np.asarray([])
+        return np.fft.rfftfreq(self._length, 1.0 / self._sample_rate)
+
+    def _one_sided(self, scale):
+        power = self._power * (scale / self._count)
+        power[1:(self._length + 1) // 2] *= 2  # all but DC and Nyquist hold both halves
+        return power
+
+    # Power spectral density in V**2/Hz, e.g. to compare noise between sample rates
+    @property
+    def psd(self):
+        if self._count == 0:
+            return np.asarray([])
+        return self._one_sided(1.0 / (self._sample_rate * get_window(self._window, self._length)[2]))
+
+    # Power in V**2 (rms) per frequency bin, so a sine's peak is its rms value squared
+    @property
+    def power(self):
+        if self._count == 0:
+            return np.asarray([])
+        return self._one_sided(1.0 / get_window(self._window, self._length)[1] ** 2)
+
+    # power in dB relative to 1 Vrms, as the scope shows it
+    @property
+    def dbv(self):
+        with np.errstate(divide='ignore'):
+            return 10 * np.log10(self.power)
+
+
+def spectrum(volts, sample_rate, segment_length=SEGMENT_POINTS, window=HANN, overlap=OVERLAP):
+    """ Frequencies and power (V**2 rms per bin) of one record """
+    welch = Welch(sample_rate, segment_length, window, overlap)
+    welch.add(volts)
+    return welch.frequencies, welch.power
+
+
+# Samples per second of a channel's record.  The 600 points of NOR mode are the screen's
+# 12 divisions rather than samples at the channel's sample rate.
+def record_sample_rate(scp, ch):
+    if ch.num_points == 600:
+        return 50.0 / scp.time_per_division
+    return ch.sample_rate
+
+
+def channel_spectrum(ch, segment_length=SEGMENT_POINTS, window=HANN, overlap=OVERLAP, sample_rate=None):
+    """ A Welch holding the spectrum of a channel's record """
+    if sample_rate is None:
+        sample_rate = ch.sample_rate
+    welch = Welch(sample_rate, segment_length, window, overlap)
+    welch.add_channel(ch, sample_rate)
+    return welch
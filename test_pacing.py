@@ -0,0 +1,69 @@
+# Copyright (c) 2015, Vinnie M.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Checks rigolusb's default pacing against scope_sim: no command may reach the scope sooner
+# than the settle time after a set command.
+#
+#     python -m unittest test_pacing
+
+import os
+import unittest
+import rigolusb
+import scope
+import scope_sim
+
+SETTLE_TIME = 0.020  # what the DS1052E needs after a set command
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'scope_sim needs a pseudo-terminal')
+class DefaultPacingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = scope_sim.SimulatedDS1052E(min_command_interval=SETTLE_TIME)
+        self.sim.start()
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def test_default_is_adaptive(self):
+        self.assertEqual(rigolusb.get_pacing(), rigolusb.ADAPTIVE)
+
+    def test_query_scope(self):
+        scp = scope.DS1000(self.sim.device_path, 2)
+        for mode in ['NOR', 'NOR', 'NOR', 'RAW']:
+            scp.query_scope(mode)
+        self.assertEqual(self.sim.violations, 0)
+
+    def test_session(self):
+        with scope.DS1000(self.sim.device_path, 2) as scp:
+            for i in range(5):
+                scp.query_scope('NOR')
+        self.assertEqual(self.sim.violations, 0)
+
+    def test_stream(self):
+        scp = scope.DS1000(self.sim.device_path, 2)
+        for rearm in [scope.SINGLE, scope.RUN]:
+            for frame in scp.stream('RAW', count=3, rearm=rearm):
+                pass
+        self.assertEqual(self.sim.violations, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()